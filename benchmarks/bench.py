@@ -0,0 +1,198 @@
+#!/usr/local/bin/python3
+
+"""
+    End-to-end load benchmark against the local fake MELCloud server (See fake_melcloud.py)
+
+    Phases:
+        startup (sync):     MelCloudAuthentication.login() + MelCloud.getDevicesList()
+        startup (async):    MelCloudAuthenticationAsync.async_login() + MelCloudAsync.async_getDevicesList()
+        poll:               MelCloudDeviceAsync.async_refresh_device_info() + state reads for every device, repeated --cycles times
+        commands:           mode/temperature/fan speed burst on every device (Power on for Vent)
+        poll (entity):      MelCloudClimate.async_update() + state reads for every entity, repeated --cycles times
+        commands (entity):  set_hvac_mode/set_temperature/set_fan_mode burst on every entity
+        relogin:            poll cycle right after all ContextKeys expired (401 path)
+
+    Entity phases run only when Home Assistant is installed, the other ones only need the API client (melcloud.py)
+
+    For each phase: number of operations, MELCloud calls (Per endpoint), requests/sec and p50/p99 operation latency
+
+    Usage:
+        python3 bench.py --devices 50 --latency 0.05 --cycles 5
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "custom_components"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_melcloud import FakeMelCloud, FakeMelCloudServer
+from melcloud import melcloud
+
+try:
+    from melcloud import climate
+except ImportError:
+    climate = None #No HomeAssistant: entity phases are skipped
+
+# ---------------------------------------------------------------
+
+def percentile(values, percent):
+    if len(values) == 0:
+        return 0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))]
+
+class Phase:
+    def __init__(self, name, server):
+        self._name = name
+        self._server = server
+        self._latencies = []
+
+    def __enter__(self):
+        self._server.melcloud.resetCalls()
+        self._start_s = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._duration_s = time.perf_counter() - self._start_s
+        self.report()
+
+    def record(self, latency_s):
+        self._latencies.append(latency_s)
+
+    def report(self):
+        calls = self._server.melcloud.getCalls()
+        total = sum(calls.values())
+
+        print("%-18s %6d ops %8.3fs %6d calls %8.1f req/s   p50 %7.1fms   p99 %7.1fms   %s" % (
+            self._name, len(self._latencies), self._duration_s, total, total / self._duration_s if self._duration_s > 0 else 0,
+            percentile(self._latencies, 50) * 1000, percentile(self._latencies, 99) * 1000,
+            ", ".join(endpoint + "=" + str(count) for endpoint, count in sorted(calls.items()))))
+
+# ---------------------------------------------------------------
+
+def bench_sync_startup(server, args):
+    with Phase("startup (sync)", server) as phase:
+        start_s = time.perf_counter()
+
+        mcauth = melcloud.MelCloudAuthentication("bench@localhost", "bench", base_url = server.getUrl(), pool_size = args.pool_size)
+        mcauth.login()
+        devices = melcloud.MelCloud(mcauth, args.parallel).getDevicesList()
+
+        phase.record(time.perf_counter() - start_s)
+
+    mcauth.close()
+    return devices
+
+async def async_timed(phase, coroutine):
+    start_s = time.perf_counter()
+    await coroutine
+    phase.record(time.perf_counter() - start_s)
+
+def read_state(device):
+    return (device.isPowerOn(), device.getMode(), device.getTemperature(), device.getRoomTemperature(), device.getFanSpeed())
+
+def read_entity_state(entity):
+    return (entity.hvac_mode, entity.target_temperature, entity.current_temperature, entity.fan_mode, entity.swing_mode)
+
+async def async_bench_entities(server, args, mc, devices):
+    entities = []
+    for device in devices:
+        entity = climate.MelCloudClimate(device)
+        entity.async_schedule_update_ha_state = lambda *args: None #No HomeAssistant
+        entities.append(entity)
+
+    async def async_poll(entity):
+        await entity.async_update()
+        read_entity_state(entity)
+
+    with Phase("poll (entity)", server) as phase:
+        for cycle in range(args.cycles):
+            mc._last_refresh_time_s = 0 #New poll cycle
+            await asyncio.gather(*[async_timed(phase, async_poll(entity)) for entity in entities])
+
+    async def async_command(entity):
+        if entity._device.getDeviceType() == melcloud.DeviceType.Conditioner:
+            await asyncio.gather(entity.async_set_hvac_mode(climate.HVAC_MODE_HEAT), entity.async_set_temperature(**{climate.ATTR_TEMPERATURE: 22}), entity.async_set_fan_mode(entity.fan_modes[2]))
+        else:
+            await entity.async_turn_off()
+
+    with Phase("commands (entity)", server) as phase:
+        await asyncio.gather(*[async_timed(phase, async_command(entity)) for entity in entities])
+
+async def async_bench(server, args):
+    mcauth = melcloud.MelCloudAuthenticationAsync("bench@localhost", "bench", base_url = server.getUrl(), pool_size = args.pool_size)
+    mc = melcloud.MelCloudAsync(mcauth, args.parallel, command_debounce_seconds = args.debounce)
+
+    with Phase("startup (async)", server) as phase:
+        start_s = time.perf_counter()
+        await mcauth.async_login()
+        devices = await mc.async_getDevicesList()
+        phase.record(time.perf_counter() - start_s)
+
+    async def async_poll(device):
+        await device.async_refresh_device_info()
+        read_state(device)
+
+    with Phase("poll", server) as phase:
+        for cycle in range(args.cycles):
+            mc._last_refresh_time_s = 0 #New poll cycle
+            await asyncio.gather(*[async_timed(phase, async_poll(device)) for device in devices])
+
+    async def async_set(device, setter, *args):
+        setter(*args)
+        await device.async_apply()
+
+    async def async_command(device):
+        if device.getDeviceType() == melcloud.DeviceType.Conditioner:
+            await asyncio.gather(async_set(device, device.setMode, melcloud.Mode.Cool), async_set(device, device.setTemperature, 23), async_set(device, device.setFanSpeed, 1))
+        else:
+            await async_set(device, device.powerOn)
+
+    with Phase("commands", server) as phase:
+        await asyncio.gather(*[async_timed(phase, async_command(device)) for device in devices])
+
+    if climate != None:
+        await async_bench_entities(server, args, mc, devices)
+
+    server.melcloud.expireKeys()
+
+    with Phase("relogin", server) as phase:
+        mc._last_refresh_time_s = 0
+        await asyncio.gather(*[async_timed(phase, async_poll(device)) for device in devices])
+
+    await mcauth.async_close()
+
+# ---------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "MELCloud integration load benchmark")
+    parser.add_argument("--devices", type = int, default = 50)
+    parser.add_argument("--latency", type = float, default = 0.05, help = "Fake server latency per request (seconds)")
+    parser.add_argument("--rate-limit", type = int, default = 0, help = "Fake server max requests per second (0 = unlimited)")
+    parser.add_argument("--error-rate", type = float, default = 0, help = "Fake server fraction of requests replying 503")
+    parser.add_argument("--command-delay", type = float, default = 0, help = "Fake server delay before commands are applied (seconds)")
+    parser.add_argument("--cycles", type = int, default = 5, help = "Number of poll cycles")
+    parser.add_argument("--pool-size", type = int, default = melcloud.DEFAULT_POOL_SIZE)
+    parser.add_argument("--parallel", type = int, default = melcloud.DEFAULT_MAX_PARALLEL_REQUESTS)
+    parser.add_argument("--debounce", type = float, default = melcloud.DEFAULT_COMMAND_DEBOUNCE)
+    parser.add_argument("--no-list-state", action = "store_true", help = "ListDevices without devices state (Device/Get needed)")
+    parser.add_argument("--verbose", action = "store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(stream = sys.stdout, level = logging.DEBUG if args.verbose else logging.CRITICAL)
+
+    server = FakeMelCloudServer(FakeMelCloud(args.devices, args.latency, rate_limit = args.rate_limit, list_state = not args.no_list_state, error_rate = args.error_rate, command_delay = args.command_delay)).start()
+    print("Fake MELCloud: " + server.getUrl() + " (" + str(args.devices) + " device(s), " + str(args.latency * 1000) + "ms latency)")
+
+    try:
+        bench_sync_startup(server, args)
+        asyncio.run(async_bench(server, args))
+    finally:
+        server.stop()
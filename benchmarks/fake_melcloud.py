@@ -0,0 +1,310 @@
+#!/usr/local/bin/python3
+
+"""
+    Local MELCloud stand-in server (No network access needed)
+
+    Implements:
+        POST /Mitsubishi.Wifi.Client/Login/ClientLogin
+        GET  /Mitsubishi.Wifi.Client/User/ListDevices
+        GET  /Mitsubishi.Wifi.Client/Device/Get
+        POST /Mitsubishi.Wifi.Client/Device/SetAta
+        POST /Mitsubishi.Wifi.Client/Device/SetErv
+
+    Options:
+        devices:        Number of devices (Spread over flat/areas/floors, every 10th device is a Vent)
+        latency:        Delay added to every reply (seconds)
+        key_ttl:        ContextKey lifetime, after that requests reply 401 (seconds, 0 = never expire)
+        rate_limit:     Max requests per second, after that requests reply 429 (0 = unlimited)
+        list_state:     Include devices state in ListDevices "Device" block (As melcloud does)
+        error_rate:     Fraction of requests replying 503 (0 to 1)
+        command_delay:  Commands are applied after this delay, devices report HasPendingCommand meanwhile (seconds)
+
+    Usage:
+        python3 fake_melcloud.py [port] [devices]
+"""
+
+import sys
+import random
+import json
+import time
+import uuid
+import threading
+import urllib.parse
+import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BASE_PATH = "/Mitsubishi.Wifi.Client"
+
+# ---------------------------------------------------------------
+
+class FakeMelCloud:
+    def __init__(self, devices = 10, latency = 0, key_ttl = 0, rate_limit = 0, list_state = True, error_rate = 0, command_delay = 0):
+        self.latency = latency
+        self.key_ttl = key_ttl
+        self.rate_limit = rate_limit
+        self.list_state = list_state
+        self.error_rate = error_rate
+        self.command_delay = command_delay
+
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._window_s = 0
+        self._window_count = 0
+        self._calls = {}
+        self._devices = {}
+        self._commands = [] #(Apply time, device, values)
+
+        for i in range(devices):
+            deviceid = 1000 + i
+            self._devices[deviceid] = {
+                "DeviceID": deviceid,
+                "BuildingID": 1 + (i // 50),
+                "DeviceName": "Unit " + str(i),
+                "DeviceType": 3 if i % 10 == 9 else 0,
+                "Power": i % 2 == 0,
+                "Offline": False,
+                "OperationMode": 1,
+                "VentilationMode": 0,
+                "SetTemperature": 21,
+                "RoomTemperature": 19.5 + (i % 5),
+                "SetFanSpeed": 0,
+                "NumberOfFanSpeeds": 5,
+                "VaneVertical": 0,
+                "VaneHorizontal": 0,
+                "HasPendingCommand": False,
+                "CurrentEnergyConsumed": 0,
+                "HasEnergyConsumedMeter": i % 10 != 9
+            }
+
+    # -----------------------------------------------------------
+
+    def getCalls(self):
+        with self._lock:
+            return dict(self._calls)
+
+    def resetCalls(self):
+        with self._lock:
+            self._calls = {}
+
+    def expireKeys(self):
+        with self._lock:
+            self._keys = {}
+
+    def _count(self, endpoint):
+        with self._lock:
+            self._calls[endpoint] = self._calls.get(endpoint, 0) + 1
+
+    def _is_rate_limited(self):
+        if self.rate_limit <= 0:
+            return False
+
+        with self._lock:
+            now = int(time.time())
+            if now != self._window_s:
+                self._window_s = now
+                self._window_count = 0
+
+            self._window_count += 1
+            return self._window_count > self.rate_limit
+
+    def _apply_commands(self):
+        #Lock must be held
+        now = time.time()
+        for device in self._devices.values():
+            if device["Power"]:
+                device["CurrentEnergyConsumed"] += 1 #Wh, per read
+
+
+        while len(self._commands) > 0 and self._commands[0][0] <= now:
+            apply_time_s, device, values = self._commands.pop(0)
+            device.update(values)
+            device["HasPendingCommand"] = any(command[1] is device for command in self._commands)
+
+    def _is_key_valid(self, key):
+        with self._lock:
+            if key not in self._keys:
+                return False
+
+            return self.key_ttl <= 0 or time.time() < self._keys[key]
+
+    # -----------------------------------------------------------
+
+    def login(self, form):
+        key = uuid.uuid4().hex
+        expiry = time.time() + (self.key_ttl if self.key_ttl > 0 else 365 * 24 * 3600)
+
+        with self._lock:
+            self._keys[key] = expiry
+
+        return 200, {"ErrorId": None, "LoginData": {"ContextKey": key, "Expiry": datetime.datetime.utcfromtimestamp(expiry).strftime("%Y-%m-%dT%H:%M:%S")}}
+
+    def listDevices(self, form):
+        buildings = {}
+
+        with self._lock:
+            self._apply_commands()
+            for i, device in enumerate(self._devices.values()):
+                building = buildings.setdefault(device["BuildingID"], {"ID": device["BuildingID"], "Structure": {"Devices": [], "Areas": [{"Devices": []}], "Floors": [{"Devices": [], "Areas": [{"Devices": []}]}]}})
+
+                entry = {"DeviceID": device["DeviceID"], "BuildingID": device["BuildingID"], "DeviceName": device["DeviceName"]}
+                if self.list_state:
+                    state = dict(device)
+                    state["FanSpeed"] = state.pop("SetFanSpeed")
+                    state["VaneVerticalDirection"] = state.pop("VaneVertical")
+                    state["VaneHorizontalDirection"] = state.pop("VaneHorizontal")
+                    entry["Device"] = state
+
+                structure = building["Structure"]
+                location = [structure["Devices"], structure["Areas"][0]["Devices"], structure["Floors"][0]["Devices"], structure["Floors"][0]["Areas"][0]["Devices"]][i % 4]
+                location.append(entry)
+
+        return 200, list(buildings.values())
+
+    def getDevice(self, form):
+        with self._lock:
+            self._apply_commands()
+            deviceid = int(form.get("id", 0))
+            if deviceid not in self._devices:
+                return 404, None
+
+            return 200, dict(self._devices[deviceid])
+
+    def setDevice(self, form):
+        flags_keys = {0x01: "Power", 0x02: "OperationMode", 0x04: "SetTemperature", 0x08: "SetFanSpeed", 0x10: "VaneVertical", 0x100: "VaneHorizontal"}
+
+        with self._lock:
+            deviceid = int(form.get("DeviceID", 0))
+            if deviceid not in self._devices:
+                return 404, None
+
+            device = self._devices[deviceid]
+            flags = int(form.get("EffectiveFlags", 0))
+            values = {}
+
+            for flag, key in flags_keys.items():
+                if device["DeviceType"] == 3 and flag == 0x04:
+                    key = "VentilationMode"
+
+                if flags & flag and key in form:
+                    value = form[key]
+                    if key == "Power":
+                        values[key] = value in ("True", "true", "1")
+                    elif key == "SetTemperature":
+                        values[key] = float(value)
+                    else:
+                        values[key] = int(value)
+
+            if self.command_delay > 0:
+                self._commands.append((time.time() + self.command_delay, device, values))
+                device["HasPendingCommand"] = True
+                return 200, dict(device, **values)
+
+            device.update(values)
+            return 200, dict(device)
+
+    # -----------------------------------------------------------
+
+    def handle(self, method, path, headers, form):
+        endpoints = {
+            ("POST", "/Login/ClientLogin"): self.login,
+            ("GET", "/User/ListDevices"): self.listDevices,
+            ("GET", "/Device/Get"): self.getDevice,
+            ("POST", "/Device/SetAta"): self.setDevice,
+            ("POST", "/Device/SetErv"): self.setDevice
+        }
+
+        endpoint = path[len(BASE_PATH):] if path.startswith(BASE_PATH) else path
+        self._count(endpoint)
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if (method, endpoint) not in endpoints:
+            return 404, None
+
+        if self._is_rate_limited():
+            return 429, None
+
+        if self.error_rate > 0 and random.random() < self.error_rate:
+            return 503, None
+
+        if endpoint != "/Login/ClientLogin" and not self._is_key_valid(headers.get("X-MitsContextKey")):
+            return 401, None
+
+        return endpoints[(method, endpoint)](form)
+
+# ---------------------------------------------------------------
+
+class FakeMelCloudHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" #Keep-alive
+
+    def _reply(self, method):
+        url = urllib.parse.urlparse(self.path)
+        form = dict(urllib.parse.parse_qsl(url.query))
+
+        length = int(self.headers.get("Content-Length", 0))
+        if length > 0:
+            form.update(urllib.parse.parse_qsl(self.rfile.read(length).decode()))
+
+        status, reply = self.server.melcloud.handle(method, url.path, self.headers, form)
+
+        body = json.dumps(reply).encode() if reply != None else b""
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply("GET")
+
+    def do_POST(self):
+        self._reply("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+# ---------------------------------------------------------------
+
+class FakeMelCloudHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 512 #Default (5) makes concurrent clients wait for SYN retries
+
+class FakeMelCloudServer:
+    def __init__(self, melcloud, host = "127.0.0.1", port = 0):
+        self.melcloud = melcloud
+        self._server = FakeMelCloudHTTPServer((host, port), FakeMelCloudHandler)
+        self._server.daemon_threads = True
+        self._server.melcloud = melcloud
+        self._thread = None
+
+    def getUrl(self):
+        host, port = self._server.server_address
+        return "http://" + host + ":" + str(port) + BASE_PATH
+
+    def start(self):
+        self._thread = threading.Thread(target = self._server.serve_forever, daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+# ---------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    devices = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    server = FakeMelCloudServer(FakeMelCloud(devices), port = port)
+    print("Fake MELCloud listening on " + server.getUrl() + " (" + str(devices) + " device(s))")
+
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -1 +1,8 @@
 """The Melcloud integration."""
+
+DATA_HASS_CONFIG = "melcloud_hass_config"
+
+async def async_setup(hass, config):
+    #Set up by HomeAssistant before the climate platform, keep the real configuration to load the sensor platform (See climate.py)
+    hass.data[DATA_HASS_CONFIG] = config
+    return True
@@ -11,7 +11,7 @@
         HA climate example: https://github.com/home-assistant/home-assistant/blob/dev/homeassistant/components/climate/demo.py
     
     How to install:
-        Copy this file in <config_dir>/custom_components/melcloud/climate.py
+        Copy this folder in <config_dir>/custom_components/melcloud/
         Edit configuration.yaml and add below lines:
         
             climate:
@@ -27,17 +27,17 @@
                 default: info
                 logs:
                     custom_components.melcloud.climate: debug
+                    custom_components.melcloud.melcloud: debug
     
     Workflow:
         During startup the script will try to login on your account (Email/password)
         If the login step fail, the setup will also fail and this components will be unload by HomeAssistant
-        Once login succeeded, we will download the list of all devices available on your melcloud account (This step is done everytime this component is loaded)
-        We don't cache any data to be as synchronized as possible, so, on every HomeAssistant startup we will re-download the list and get the most up to date device list.
-        Thus, If you want to add a new climate to your HomeAssistant, just restart it.
+        Once login succeeded, we will download the list of all devices available on your melcloud account
+        The devices list, their last state and the contextKey are cached in <config_dir>/.storage/melcloud.*, on next startup devices are created from this cache
+        and the list is re-downloaded in background: new devices are added and removed ones are removed.
+        The same topology sync is done periodically by the poll loop (No restart needed to pick up a new unit)
         
-        Once we successfully login, we will retrive the "contextKey" and we will use this auth to all our requests
-        If an error 401 occured, it means contextKey has expired, in this case we will re-login
-        If any other error occured, we will abort.
+        Requests, polling, re-login, retries: see the API client (melcloud.py)
     
     License:
                 DO WHAT THE FUCK YOU WANT TO PUBLIC LICENSE 
@@ -53,364 +53,138 @@
          0. You just DO WHAT THE FUCK YOU WANT TO.
 """
 
-import requests
-import sys
+import asyncio
 import logging
+import hashlib
 import time
-import json
 
 #TODO: 
 # FOLLOW HOME ASSISTANT GUIDLINE
-# - Use keep alive to avoid too many reconnection
-#   s = requests.Session()
-#   s.get(), s.post() instead of requests.get
 
 _LOGGER = logging.getLogger(__name__)
 
 import voluptuous as vol
 from homeassistant.components.climate import ClimateDevice, PLATFORM_SCHEMA
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.discovery import async_load_platform
 from homeassistant.components.climate.const import SUPPORT_TARGET_TEMPERATURE, SUPPORT_FAN_MODE, SUPPORT_SWING_MODE
 from homeassistant.components.climate.const import ATTR_TARGET_TEMP_HIGH, ATTR_TARGET_TEMP_LOW
 from homeassistant.components.climate.const import HVAC_MODE_AUTO, HVAC_MODE_OFF, HVAC_MODE_COOL, HVAC_MODE_HEAT, HVAC_MODE_DRY, HVAC_MODE_FAN_ONLY
-from homeassistant.const import CONF_PASSWORD, CONF_EMAIL, TEMP_CELSIUS, ATTR_TEMPERATURE
+from homeassistant.const import CONF_PASSWORD, CONF_EMAIL, CONF_TIMEOUT, TEMP_CELSIUS, ATTR_TEMPERATURE, ATTR_ENTITY_ID, EVENT_HOMEASSISTANT_STOP
 import homeassistant.helpers.config_validation as cv
 
+from . import DATA_HASS_CONFIG
+from .melcloud import (
+    DEFAULT_BACKOFF, DEFAULT_COMMAND_DEBOUNCE, DEFAULT_CONNECT_TIMEOUT, DEFAULT_FAST_POLL_INTERVAL,
+    DEFAULT_IDLE_POLL_INTERVAL, DEFAULT_INFO_TTL, DEFAULT_MAX_PARALLEL_COMMANDS,
+    DEFAULT_MAX_PARALLEL_REQUESTS, DEFAULT_MAX_RETRIES, DEFAULT_MAX_STALENESS, DEFAULT_POLL_INTERVAL,
+    DEFAULT_POOL_SIZE, DEFAULT_TELEMETRY_SIZE, DEFAULT_TEMPERATURE_WINDOW, DEFAULT_TIMEOUT,
+    DEFAULT_TOPOLOGY_SYNC_INTERVAL, DeviceType, Language, MelCloudAsync, MelCloudAuthenticationAsync,
+    Mode, VentilationMode
+)
+
 #class ClimateDevice:
 #    pass
 
 # ---------------------------------------------------------------
 
-PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
-    vol.Required(CONF_PASSWORD): cv.string,
-    vol.Required(CONF_EMAIL): cv.string
+CONF_POOL_SIZE = "pool_size"
+CONF_CONNECT_TIMEOUT = "connect_timeout"
+CONF_COMMAND_DEBOUNCE = "command_debounce"
+CONF_INFO_TTL = "info_ttl"
+CONF_MAX_STALENESS = "max_staleness"
+CONF_FAST_POLL_INTERVAL = "fast_poll_interval"
+CONF_POLL_INTERVAL = "poll_interval"
+CONF_IDLE_POLL_INTERVAL = "idle_poll_interval"
+CONF_MAX_RETRIES = "max_retries"
+CONF_ACCOUNTS = "accounts"
+CONF_TOPOLOGY_SYNC_INTERVAL = "topology_sync_interval"
+CONF_TEMPERATURE_WINDOW = "temperature_window"
+CONF_MAX_PARALLEL_COMMANDS = "max_parallel_commands"
+CONF_TELEMETRY_SIZE = "telemetry_size"
+CONF_TELEMETRY_PERSIST = "telemetry_persist"
+
+STORAGE_VERSION = 1
+STORAGE_KEY = "melcloud"
+STORAGE_TELEMETRY_KEY = "melcloud_telemetry"
+STORAGE_SAVE_DELAY = 300 #seconds
+
+ACCOUNT_SCHEMA = vol.Schema({
+    vol.Required(CONF_EMAIL): cv.string,
+    vol.Required(CONF_PASSWORD): cv.string
 })
 
-# ---------------------------------------------------------------
-
-class Language:
-    English = 0
-    German = 4
-    Spanish = 6
-    French = 7
-    Italian = 19
-    
-# ---------------------------------------------------------------
-
-class Mode:
-    Heat = 1
-    Dry = 2
-    Cool = 3
-    Fan = 7
-    Auto = 8
-
-# ---------------------------------------------------------------
-
-class VentilationMode:
-    EnergyRecovery = 0
-    ByPass = 1
-    Auto = 2
-
-# ---------------------------------------------------------------
-
-class DeviceType:
-    Conditioner = 0
-    Vent = 3
-
-# ---------------------------------------------------------------
-
-class MelCloudAuthentication:
-    def __init__(self, email, password, language = Language.English):
-        self._email = email
-        self._password = password
-        self._language = language
-        self._contextkey = None
-
-    def isLogin(self):
-        return self._contextkey != None
-        
-    def login(self):
-        _LOGGER.debug("Login ...")
-
-        self._contextkey = None
-        
-        req = requests.post("https://app.melcloud.com/Mitsubishi.Wifi.Client/Login/ClientLogin", data={"Email": self._email ,"Password": self._password, "Language": self._language, "AppVersion": "1.15.3.0", "Persist": False})
-        
-        if req.status_code == 200:
-            reply = req.json()
-            if "ErrorId" in reply and reply["ErrorId"] == None:
-                self._contextkey = reply["LoginData"]["ContextKey"]
-                return True
-            else:
-                _LOGGER.error("Login/Password invalid ! ")
-
-        else:
-            _LOGGER.error("Login status code invalid: " + str(req.status_code))
-
-        return False
-        
-    def getContextKey(self):
-        return self._contextkey
-        
-    def sendReq(self, method, url, data = None, retry = 0):
-        if retry > 1:
-            return False, None
-        
-        req = requests.request(method, url, headers = {'X-MitsContextKey': self.getContextKey()}, data = data)
-        
-        if req.status_code == 200:
-            # _LOGGER.debug(json.dumps(req.json()))
-            return True, req.json()
-            
-        elif req.status_code == 401:
-            _LOGGER.error("Unable to URL: '" + str(url) + "', error 401 (Try to re-login...)")
-            if self.login():
-                return self.sendReq(method, url, data, retry + 1)
-        else:
-            _LOGGER.error("Unable to retrieve information from URL: '" + str(url) + "' (Invalid status code: " + str(req.status_code) + ")")
-
-        return False
-        
-# ---------------------------------------------------------------
-
-class MelCloudDevice:
-
-    def __init__(self, deviceid, buildingid, friendlyname, authentication):
-        self._deviceid = deviceid
-        self._buildingid = buildingid
-        self._friendlyname = friendlyname
-        self._authentication = authentication
-        self._info_lease_seconds = 60 #Data stay valid during 60s, after that we refresh it
-        self._json = None
-        self._temp_list = []
-    
-        self._refresh_device_info()
-            
-    def __str__(self):
-        return str(self._json)
-        #return "Name: " + self._friendlyname + " ID: " + str(self._deviceid) + " BuildingID: " + str(self._buildingid)
-        #return "Temp: " + str(self.getTemperature()) + ", RoomTemp: " + str(self.getRoomTemperature()) + ", FanSpeed: " + str(self.getFanSpeed()) + ", Mode: " + str(self.getMode()) + ", PowerOn: " + str(self.isPowerOn()) + ", Online: " + str(self.isOnline())
-
-    def _refresh_device_info(self):
-        self._json = None
-        self._last_info_time_s = time.time()
-
-        success, json = self._authentication.sendReq("GET", "https://app.melcloud.com/Mitsubishi.Wifi.Client/Device/Get", data = {'id': self._deviceid, 'buildingID': self._buildingid})
-        
-        if success:
-            self._json = json
-
-            if "RoomTemperature" in self._json:
-                self._temp_list.append(self._json["RoomTemperature"])
-                self._temp_list = self._temp_list[-10:] #Keep only last 10 temperature
-
-            return True
-
-        return False
-    
-    def _get_info(self, key, default_value):
-        if not self._is_info_valid():
-            return default_value
-        
-        if key not in self._json:
-            return default_value
-        
-        return self._json[key]
-    
-    def _is_info_valid(self):
-        if self._json == None:
-            return self._refresh_device_info()
-        
-        if (time.time() - self._last_info_time_s) >= self._info_lease_seconds:
-            _LOGGER.info("Device info lease timeout, refreshing...")
-            return self._refresh_device_info()
-            
-        return True
-        
-    def apply(self):
-        if self._json == None:
-            _LOGGER.error("Unable to apply device configuration !")
-            return False
-
-        #EffectiveFlags:
-        #Power:                0x01
-        #OperationMode:        0x02
-        #Temperature:        0x04
-        #FanSpeed:            0x08
-        #VaneVertical:        0x10
-        #VaneHorizontal:    0x100
-        #Signal melcloud we want to change everything (Even if it't not true, by this way we make sure the configuration is complete)
-        self._json["EffectiveFlags"] = 0x1F
-        self._json["HasPendingCommand"] = True
-
-        set_api = "SetAta"
-        if self._json["DeviceType"] == DeviceType.Vent:
-            set_api = "SetErv"
-            
-        success, json = self._authentication.sendReq("POST", "https://app.melcloud.com/Mitsubishi.Wifi.Client/Device/" + set_api, data = self._json)
-        return success
-
-    def getID(self):
-        return self._deviceid
-        
-    def getFriendlyName(self):
-        return self._friendlyname
-
-    def getDeviceType(self):
-        return self._json["DeviceType"]
-
-    def getTemperature(self):
-        return self._get_info("SetTemperature", None)
-
-    def getRoomTemperature(self):
-        if not self._is_info_valid():
-            return 0
-                    
-        if len(self._temp_list) == 0:
-            return 0 #Avoid div 0
-        
-        return round((sum(self._temp_list) / len(self._temp_list)), 1)
-    
-    def getFanSpeedMax(self):
-        return self._get_info("NumberOfFanSpeeds", None)
-    
-    def getFanSpeed(self): #0 Auto, 1 to NumberOfFanSpeeds
-        return self._get_info("SetFanSpeed", None)
-    
-    def getVerticalSwingMode(self): #0 Auto, 1 to NumberOfVane, +1 Swing
-        return self._get_info("VaneVertical", None)
-
-    def getHorizontalSwingMode(self): #0 Auto, 1 to NumberOfVane, +1 Swing
-        return self._get_info("VaneHorizontal", None)
-        
-    def getMode(self):
-        return self._get_info("OperationMode", Mode.Auto)
-
-    def getVentMode(self):
-        return self._get_info("VentilationMode", VentilationMode.Auto)
-
-    def isPowerOn(self): #boolean
-        return self._get_info("Power", False)
-
-    def isOnline(self): #boolean
-        return self._get_info("Offline", False)
-
-    def setVerticalSwingMode(self, swingMode):
-        if not self._is_info_valid():
-            _LOGGER.error("Unable to set swing mode: " + str(swingMode))
-            return False
-            
-        self._json["VaneVertical"] = swingMode
-        return True
-
-    def setHorizontalSwingMode(self, swingMode):
-        if not self._is_info_valid():
-            _LOGGER.error("Unable to set swing mode: " + str(swingMode))
-            return False
-            
-        self._json["VaneHorizontal"] = swingMode
-        return True
-
-        
-    def setTemperature(self, temperature):
-        if not self._is_info_valid():
-            _LOGGER.error("Unable to set temperature: " + str(temperature))
-            return False
-            
-        self._json["SetTemperature"] = temperature
-        return True
-
-    def setFanSpeed(self, speed): #0 Auto, 1 to NumberOfFanSpeeds
-        if not self._is_info_valid():
-            _LOGGER.error("Unable to set fan speed: " + str(speed))
-            return False
-            
-        self._json["SetFanSpeed"] = speed
-        return True
-        
-    def setMode(self, mode):
-        if not self._is_info_valid():
-            _LOGGER.error("Unable to set mode: " + str(mode))
-            return
-            
-        self._json["OperationMode"] = mode
-
-    def setVentMode(self, mode):
-        if not self._is_info_valid():
-            _LOGGER.error("Unable to set mode: " + str(mode))
-            return
-
-        self._json["VentilationMode"] = mode
-
-    def powerOn(self):
-        if not self._is_info_valid():
-            _LOGGER.error("Unable to powerOn")
-            return False
-            
-        self._json["Power"] = True
-        return True
-        
-    def powerOff(self):
-        if not self._is_info_valid():
-            _LOGGER.error("Unable to powerOff")
-            return False
-            
-        self._json["Power"] = False
-        return True
-
-# ---------------------------------------------------------------
-
-class MelCloud:
-    def __init__(self, authentication):
-        self._authentication = authentication
-        
-    def getDevicesList(self):
-        devices = []
-        
-        success, json = self._authentication.sendReq("GET", "https://app.melcloud.com/Mitsubishi.Wifi.Client/User/ListDevices")
-        if success:
-            #_LOGGER.debug(json)
-            for entry in json:
-            
-                #Flat devices
-                for device in entry["Structure"]["Devices"]:
-                    devices.append( MelCloudDevice(device["DeviceID"], device["BuildingID"], device["DeviceName"], self._authentication) )
-                
-                #Areas devices
-                for areas in entry["Structure"]["Areas"]:
-                    for device in areas["Devices"]:
-                        devices.append( MelCloudDevice(device["DeviceID"], device["BuildingID"], device["DeviceName"], self._authentication) )
-                
-                #Floor devices
-                for floor in entry["Structure"]["Floors"]:
-                    for device in floor["Devices"]:
-                        devices.append( MelCloudDevice(device["DeviceID"], device["BuildingID"], device["DeviceName"], self._authentication) )
-                    
-                    for areas in floor["Areas"]:
-                        for device in areas["Devices"]:
-                            devices.append( MelCloudDevice(device["DeviceID"], device["BuildingID"], device["DeviceName"], self._authentication) )
-
-        return devices
-
-# ---------------------------------------------------------------
-
+PLATFORM_SCHEMA = vol.All(cv.has_at_least_one_key(CONF_EMAIL, CONF_ACCOUNTS), PLATFORM_SCHEMA.extend({
+    vol.Inclusive(CONF_EMAIL, "account"): cv.string,
+    vol.Inclusive(CONF_PASSWORD, "account"): cv.string,
+    vol.Optional(CONF_ACCOUNTS): vol.All(cv.ensure_list, [ACCOUNT_SCHEMA]),
+    vol.Optional(CONF_POOL_SIZE, default=DEFAULT_POOL_SIZE): cv.positive_int,
+    vol.Optional(CONF_CONNECT_TIMEOUT, default=DEFAULT_CONNECT_TIMEOUT): cv.positive_int,
+    vol.Optional(CONF_TIMEOUT, default=DEFAULT_TIMEOUT): cv.positive_int,
+    vol.Optional(CONF_COMMAND_DEBOUNCE, default=DEFAULT_COMMAND_DEBOUNCE): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Optional(CONF_INFO_TTL, default=DEFAULT_INFO_TTL): cv.positive_int,
+    vol.Optional(CONF_MAX_STALENESS, default=DEFAULT_MAX_STALENESS): cv.positive_int,
+    vol.Optional(CONF_FAST_POLL_INTERVAL, default=DEFAULT_FAST_POLL_INTERVAL): cv.positive_int,
+    vol.Optional(CONF_POLL_INTERVAL, default=DEFAULT_POLL_INTERVAL): cv.positive_int,
+    vol.Optional(CONF_IDLE_POLL_INTERVAL, default=DEFAULT_IDLE_POLL_INTERVAL): cv.positive_int,
+    vol.Optional(CONF_MAX_RETRIES, default=DEFAULT_MAX_RETRIES): vol.All(vol.Coerce(int), vol.Range(min=0)),
+    vol.Optional(CONF_TOPOLOGY_SYNC_INTERVAL, default=DEFAULT_TOPOLOGY_SYNC_INTERVAL): vol.All(vol.Coerce(int), vol.Range(min=0)),
+    vol.Optional(CONF_TEMPERATURE_WINDOW, default=DEFAULT_TEMPERATURE_WINDOW): cv.positive_int,
+    vol.Optional(CONF_MAX_PARALLEL_COMMANDS, default=DEFAULT_MAX_PARALLEL_COMMANDS): cv.positive_int,
+    vol.Optional(CONF_TELEMETRY_SIZE, default=DEFAULT_TELEMETRY_SIZE): vol.All(vol.Coerce(int), vol.Range(min=0)),
+    vol.Optional(CONF_TELEMETRY_PERSIST, default=False): cv.boolean
+}))
+
+DOMAIN = "melcloud"
+DATA_ENTITIES = DOMAIN + "_entities"
+
+SERVICE_GROUP_COMMAND = "group_command"
+EVENT_GROUP_COMMAND = DOMAIN + "_group_command"
+ATTR_HVAC_MODE = "hvac_mode"
+ATTR_FAN_MODE = "fan_mode"
+ATTR_SWING_MODE = "swing_mode"
+ATTR_POWER = "power"
+
+GROUP_COMMAND_SCHEMA = vol.Schema({
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Optional(ATTR_POWER): cv.boolean,
+    vol.Optional(ATTR_HVAC_MODE): cv.string,
+    vol.Optional(ATTR_TEMPERATURE): vol.Coerce(float),
+    vol.Optional(ATTR_FAN_MODE): cv.string,
+    vol.Optional(ATTR_SWING_MODE): cv.string
+})
 VENT_MODE_ENERGY_RECOVERY = 'energy_recovery'
 VENT_MODE_BY_PASS = 'bypass'
 VENT_MODE_AUTO = 'auto'
 MIN_TEMP = 16
 MAX_TEMP = 30
 
+#Lookup tables, both ways (Device value <-> HomeAssistant mode)
+HVAC_MODES = {
+    DeviceType.Conditioner: {Mode.Heat: HVAC_MODE_HEAT, Mode.Cool: HVAC_MODE_COOL, Mode.Dry: HVAC_MODE_DRY, Mode.Fan: HVAC_MODE_FAN_ONLY, Mode.Auto: HVAC_MODE_AUTO},
+    DeviceType.Vent: {VentilationMode.EnergyRecovery: VENT_MODE_ENERGY_RECOVERY, VentilationMode.ByPass: VENT_MODE_BY_PASS, VentilationMode.Auto: VENT_MODE_AUTO}
+}
+HVAC_MODES_IDS = {device_type: {hvac_mode: mode for mode, hvac_mode in modes.items()} for device_type, modes in HVAC_MODES.items()}
+HVAC_MODES_LIST = {
+    DeviceType.Conditioner: [HVAC_MODE_HEAT, HVAC_MODE_COOL, HVAC_MODE_DRY, HVAC_MODE_FAN_ONLY, HVAC_MODE_AUTO, HVAC_MODE_OFF],
+    DeviceType.Vent: [VENT_MODE_ENERGY_RECOVERY, VENT_MODE_BY_PASS, VENT_MODE_AUTO]
+}
+
+SWING_MODES = {0: 'Auto', 1: 'Top', 2: 'MiddleTop', 3: 'Middle', 4: 'MiddleBottom', 5: 'Bottom', 7: 'Swing'}
+SWING_MODES_IDS = {swing_mode: swing_id for swing_id, swing_mode in SWING_MODES.items()}
+SWING_MODES_LIST = list(SWING_MODES.values())
+
 class MelCloudClimate(ClimateDevice):
 
     def __init__(self, device):
         self._device = device
+        self._state = device.getState() #Refreshed in place by the device
         
         self._fan_modes = ['Speed Auto', 'Speed 1 (Min)']
-        for i in range(2, self._device.getFanSpeedMax()):
+        for i in range(2, self._state.fanSpeedMax):
             self._fan_modes.append('Speed ' + str(i))
-        self._fan_modes.append('Speed ' + str(self._device.getFanSpeedMax()) + " (Max)")
-        
-        self._swing_modes = ['Auto', 'Top', 'MiddleTop', 'Middle', 'MiddleBottom', 'Bottom', 'Swing']
-        self._swing_id = [0, 1, 2, 3, 4, 5, 7]
+        self._fan_modes.append('Speed ' + str(self._state.fanSpeedMax) + " (Max)")
+        self._fan_modes_ids = {fan_mode: i for i, fan_mode in enumerate(self._fan_modes)}
         
     @property
     def supported_features(self):
@@ -418,10 +192,57 @@ class MelCloudClimate(ClimateDevice):
 
     @property
     def should_poll(self):
-        return True
+        return False #Polled by MelCloudAsync, adaptive to devices activity
+
+    async def async_added_to_hass(self):
+        self._remove_listener = self._device.addUpdateListener(self.async_schedule_update_ha_state)
+        self.hass.data.setdefault(DATA_ENTITIES, {})[self.entity_id] = self #See group_command service (Entities are not hashable)
 
-    def update(self):
-        self._device._refresh_device_info()
+    async def async_will_remove_from_hass(self):
+        self._remove_listener()
+        self.hass.data.get(DATA_ENTITIES, {}).pop(self.entity_id, None)
+
+    def getCommand(self, power = None, hvac_mode = None, temperature = None, fan_mode = None, swing_mode = None):
+        #HomeAssistant values => Device/Get values (See MelCloudDevice.setValues)
+        values = {}
+
+        if power != None:
+            values["Power"] = power
+
+        if hvac_mode == HVAC_MODE_OFF:
+            values["Power"] = False
+        elif hvac_mode != None:
+            values["Power"] = True
+            mode = HVAC_MODES_IDS.get(self._state.deviceType, {}).get(hvac_mode)
+            if mode != None:
+                values["VentilationMode" if self._state.deviceType == DeviceType.Vent else "OperationMode"] = mode
+
+        #Vent have no setpoint and no vane (A group command can mix both device types)
+        if temperature != None and self._state.deviceType != DeviceType.Vent:
+            values["SetTemperature"] = temperature
+
+        if fan_mode in self._fan_modes_ids:
+            values["SetFanSpeed"] = self._fan_modes_ids[fan_mode]
+
+        if swing_mode in SWING_MODES_IDS and self._state.deviceType != DeviceType.Vent:
+            values["VaneVertical"] = SWING_MODES_IDS[swing_mode]
+
+        return values
+
+    async def async_update(self):
+        await self._device.async_refresh_device_info()
+
+    @property
+    def available(self):
+        return self._device.isAvailable()
+
+    @property
+    def device_state_attributes(self):
+        attributes = {"stale": self._device.isStale(), "pending_command": self._device.hasPendingCommand()}
+        for key, value in self._device.getRoomTemperatureStats().items():
+            attributes["room_temperature_" + key] = value
+
+        return attributes
 
     @property
     def name(self):
@@ -437,109 +258,60 @@ class MelCloudClimate(ClimateDevice):
 
     @property
     def target_temperature(self):
-        return self._device.getTemperature()
+        return self._state.temperature
 
     @property
     def hvac_mode(self):
-        if not self._device.isPowerOn():
+        if not self._state.power:
             return HVAC_MODE_OFF
             
-        if self._device.getDeviceType() == DeviceType.Conditioner:
-            if self._device.getMode() == Mode.Heat:
-                return HVAC_MODE_HEAT
-            elif self._device.getMode() == Mode.Cool:
-                return HVAC_MODE_COOL
-            elif self._device.getMode() == Mode.Dry:
-                return HVAC_MODE_DRY
-            elif self._device.getMode() == Mode.Fan:
-                return HVAC_MODE_FAN_ONLY
-            elif self._device.getMode() == Mode.Auto:
-                return HVAC_MODE_AUTO
-                
-        elif self._device.getDeviceType() == DeviceType.Vent:
-            if self._device.getVentMode() == VentilationMode.EnergyRecovery:
-                return VENT_MODE_ENERGY_RECOVERY
-            elif self._device.getVentMode() == VentilationMode.ByPass:
-                return VENT_MODE_BY_PASS
-            elif self._device.getVentMode() == VentilationMode.Auto:
-                return VENT_MODE_AUTO
-                
-        return "" #Unknown
+        if self._state.deviceType == DeviceType.Vent:
+            return HVAC_MODES[DeviceType.Vent].get(self._state.ventMode, "")
+
+        return HVAC_MODES.get(self._state.deviceType, {}).get(self._state.mode, "") #"" = Unknown
 
     @property
     def hvac_modes(self):
-        if self._device.getDeviceType() == DeviceType.Conditioner:
-            return [HVAC_MODE_HEAT, HVAC_MODE_COOL, HVAC_MODE_DRY, HVAC_MODE_FAN_ONLY, HVAC_MODE_AUTO, HVAC_MODE_OFF]
-        elif self._device.getDeviceType() == DeviceType.Vent:
-            return [VENT_MODE_ENERGY_RECOVERY, VENT_MODE_BY_PASS, VENT_MODE_AUTO]
-
-    def set_hvac_mode(self, operation_mode):
-        if operation_mode == HVAC_MODE_OFF:
-            self._device.powerOff()
-        elif self._device.getDeviceType() == DeviceType.Conditioner:
-            self._device.powerOn()
-            if operation_mode == HVAC_MODE_HEAT:
-                self._device.setMode(Mode.Heat)
-            elif operation_mode == HVAC_MODE_COOL:
-                self._device.setMode(Mode.Cool)
-            elif operation_mode == HVAC_MODE_DRY:
-                self._device.setMode(Mode.Dry)
-            elif operation_mode == HVAC_MODE_FAN_ONLY:
-                self._device.setMode(Mode.Fan)
-            elif operation_mode == HVAC_MODE_AUTO:
-                self._device.setMode(Mode.Auto)
-        elif self._device.getDeviceType() == DeviceType.Vent:
-            self._device.powerOn()
-            if operation_mode == VENT_OPERATION_ENERGY_SAVING_STR:
-                self._device.setVentMode(VentilationMode.EnergyRecovery)
-            elif operation_mode == VENT_OPERATION_BY_PASS_STR:
-                self._device.setVentMode(VentilationMode.ByPass)
-            elif operation_mode == HVAC_MODE_AUTO:
-                self._device.setVentMode(VentilationMode.Auto)
-
-        self._device.apply()
-        self.schedule_update_ha_state()
+        return HVAC_MODES_LIST.get(self._state.deviceType)
+
+    async def async_set_hvac_mode(self, operation_mode):
+        self._device.setValues(self.getCommand(hvac_mode = operation_mode))
+
+        await self._device.async_apply()
+        self._device._notify_update()
 
     @property
     def fan_mode(self):
-        if self._device.getFanSpeed() >= len(self._fan_modes):
+        if self._state.fanSpeed >= len(self._fan_modes):
             return self._fan_modes[0]
             
-        return self._fan_modes[self._device.getFanSpeed()]
+        return self._fan_modes[self._state.fanSpeed]
         
     @property
     def fan_modes(self):
         return self._fan_modes
 
-    def set_fan_mode(self, fan_mode):
-        for i in range(0, len(self._fan_modes)):
-            if fan_mode == self._fan_modes[i]:
-                self._device.setFanSpeed(i)
-                self._device.apply()
-                break
+    async def async_set_fan_mode(self, fan_mode):
+        if fan_mode in self._fan_modes_ids:
+            self._device.setFanSpeed(self._fan_modes_ids[fan_mode])
+            await self._device.async_apply()
                 
-        self.schedule_update_ha_state()
+        self._device._notify_update()
 
     @property
     def swing_mode(self):
-        for i in range(0, len(self._swing_id)):
-            if self._device.getVerticalSwingMode() == self._swing_id[i]:
-                return self._swing_modes[i]
-                
-        return self._swing_modes[0] #Auto
-
-    def set_swing_mode(self, swing_mode):
-        for i in range(0, len(self._swing_modes)):
-            if swing_mode == self._swing_modes[i]:
-                self._device.setVerticalSwingMode(self._swing_id[i])
-                self._device.apply()
-                break
+        return SWING_MODES.get(self._state.verticalSwingMode, SWING_MODES[0]) #Auto
+
+    async def async_set_swing_mode(self, swing_mode):
+        if swing_mode in SWING_MODES_IDS:
+            self._device.setVerticalSwingMode(SWING_MODES_IDS[swing_mode])
+            await self._device.async_apply()
                 
-        self.schedule_update_ha_state()
+        self._device._notify_update()
 
     @property
     def swing_modes(self):
-        return self._swing_modes
+        return SWING_MODES_LIST
         
     @property
     def min_temp(self):
@@ -551,31 +323,100 @@ class MelCloudClimate(ClimateDevice):
         """Return the maximum temperature."""
         return MAX_TEMP
 
-    def set_temperature(self, **kwargs):
+    async def async_set_temperature(self, **kwargs):
         if kwargs.get(ATTR_TEMPERATURE) is not None:
             self._device.setTemperature(kwargs.get(ATTR_TEMPERATURE))
-            self._device.apply()
+            await self._device.async_apply()
             
-        self.schedule_update_ha_state()
+        self._device._notify_update()
 
-    def turn_on(self):
+    async def async_turn_on(self):
         self._device.powerOn()
-        self._device.apply()
-        self.schedule_update_ha_state()
+        await self._device.async_apply()
+        self._device._notify_update()
 
-    def turn_off(self):
+    async def async_turn_off(self):
         self._device.powerOff()
-        self._device.apply()
-        self.schedule_update_ha_state()
+        await self._device.async_apply()
+        self._device._notify_update()
 
 # ---------------------------------------------------------------
 
-def setup_platform(hass, config, add_devices, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     _LOGGER.debug("Adding component: melcloud ...")
 
-    email = config.get(CONF_EMAIL)
-    password = config.get(CONF_PASSWORD)
+    accounts = list(config.get(CONF_ACCOUNTS, []))
+    if config.get(CONF_EMAIL) != None:
+        accounts.insert(0, {CONF_EMAIL: config.get(CONF_EMAIL), CONF_PASSWORD: config.get(CONF_PASSWORD)})
+
+    if len(accounts) == 0:
+        _LOGGER.error("melcloud: No account configured !")
+        return False
+
+    #Accounts are independent (Own client, polling and rate limit budget): set them up concurrently
+    results = await asyncio.gather(*[_async_setup_account(hass, config, account, len(accounts) > 1, async_add_entities) for account in accounts])
+
+    if not hass.services.has_service(DOMAIN, SERVICE_GROUP_COMMAND):
+        async def async_group_command(call):
+            await _async_group_command(hass, call)
+
+        hass.services.async_register(DOMAIN, SERVICE_GROUP_COMMAND, async_group_command, schema = GROUP_COMMAND_SCHEMA)
+
+    _LOGGER.debug("melcloud: Component successfully added ! (" + str(results.count(True)) + "/" + str(len(accounts)) + " account(s))")
+    return True in results
+
+async def _async_group_command(hass, call):
+    #Same change on many entities (Scenes): one concurrent fan-out per account instead of one round trip per entity
+    entity_ids = call.data[ATTR_ENTITY_ID]
+    registry = hass.data.get(DATA_ENTITIES, {})
+    entities = [registry[entity_id] for entity_id in entity_ids if entity_id in registry]
+
+    groups = {} #account => deviceid => (entity, values)
+    for entity in entities:
+        values = entity.getCommand(call.data.get(ATTR_POWER), call.data.get(ATTR_HVAC_MODE), call.data.get(ATTR_TEMPERATURE), call.data.get(ATTR_FAN_MODE), call.data.get(ATTR_SWING_MODE))
+        groups.setdefault(entity._device._cloud, {})[entity._device.getID()] = (entity, values)
+
+    async def async_apply(mc, commands):
+        results = await mc.async_applyGroup({deviceid: values for deviceid, (entity, values) in commands.items()})
+        return {commands[deviceid][0].entity_id: success for deviceid, success in results.items()}
+
+    results = {}
+    for account_results in await asyncio.gather(*[async_apply(mc, commands) for mc, commands in groups.items()]):
+        results.update(account_results)
+
+    for entity in entities:
+        entity._device._notify_update()
+
+    for entity_id in entity_ids:
+        if entity_id not in results:
+            _LOGGER.error("melcloud: Group command, unknown entity " + entity_id)
+            results[entity_id] = False
+
+    failed = [entity_id for entity_id, success in results.items() if not success]
+    if len(failed) > 0:
+        _LOGGER.warning("melcloud: Group command failed for " + ", ".join(failed))
+
+    hass.bus.async_fire(EVENT_GROUP_COMMAND, {"results": results})
+
+async def _async_setup_account(hass, config, account, multiple, async_add_entities):
+    email = account.get(CONF_EMAIL)
+    password = account.get(CONF_PASSWORD)
     language = config.get("language", Language.English)
+    pool_size = config.get(CONF_POOL_SIZE, DEFAULT_POOL_SIZE)
+    connect_timeout = config.get(CONF_CONNECT_TIMEOUT, DEFAULT_CONNECT_TIMEOUT)
+    timeout = config.get(CONF_TIMEOUT, DEFAULT_TIMEOUT)
+    command_debounce = config.get(CONF_COMMAND_DEBOUNCE, DEFAULT_COMMAND_DEBOUNCE)
+    info_ttl = config.get(CONF_INFO_TTL, DEFAULT_INFO_TTL)
+    max_staleness = config.get(CONF_MAX_STALENESS, DEFAULT_MAX_STALENESS)
+    fast_poll_interval = config.get(CONF_FAST_POLL_INTERVAL, DEFAULT_FAST_POLL_INTERVAL)
+    poll_interval = config.get(CONF_POLL_INTERVAL, DEFAULT_POLL_INTERVAL)
+    idle_poll_interval = config.get(CONF_IDLE_POLL_INTERVAL, DEFAULT_IDLE_POLL_INTERVAL)
+    max_retries = config.get(CONF_MAX_RETRIES, DEFAULT_MAX_RETRIES)
+    max_parallel_commands = config.get(CONF_MAX_PARALLEL_COMMANDS, DEFAULT_MAX_PARALLEL_COMMANDS)
+    telemetry_size = config.get(CONF_TELEMETRY_SIZE, DEFAULT_TELEMETRY_SIZE)
+    telemetry_persist = config.get(CONF_TELEMETRY_PERSIST, False)
+    topology_sync_interval = config.get(CONF_TOPOLOGY_SYNC_INTERVAL, DEFAULT_TOPOLOGY_SYNC_INTERVAL)
+    temperature_window = config.get(CONF_TEMPERATURE_WINDOW, DEFAULT_TEMPERATURE_WINDOW)
 
     if email is None:
         _LOGGER.error("melcloud: Invalid email !")
@@ -585,46 +426,132 @@ def setup_platform(hass, config, add_devices, discovery_info=None):
         _LOGGER.error("melcloud: Invalid password !")
         return False
 
-    mcauth = MelCloudAuthentication(email, password, language)
-    if mcauth.login() == False:
-        _LOGGER.error("melcloud: Invalid Login/Password  !")
+    #One client per account, even if declared in several platform entries
+    accounts = hass.data.setdefault(DOMAIN, {})
+    if email in accounts:
+        _LOGGER.warning("melcloud: Account " + email + " already configured")
         return False
-        
-    mc = MelCloud(mcauth)
-    
-    device_list = []
-    
-    devices = mc.getDevicesList()
-    for device in devices:
-        _LOGGER.debug("melcloud: Adding new device: " + device.getFriendlyName())
-        device_list.append( MelCloudClimate(device) )
-    
-    add_devices(device_list)
-    
-    _LOGGER.debug("melcloud: Component successfully added ! (" + str(len(device_list)) + " device(s) found !)")
-    return True
+    accounts[email] = None
+
+    mcauth = MelCloudAuthenticationAsync(email, password, language, pool_size, connect_timeout, timeout)
+    mcauth.setRetryPolicy(max_retries, DEFAULT_BACKOFF)
+    mc = MelCloudAsync(mcauth, DEFAULT_MAX_PARALLEL_REQUESTS, info_ttl, max_staleness, command_debounce)
+    mc.setPollIntervals(fast_poll_interval, poll_interval, idle_poll_interval)
+    mc.setTopologySyncInterval(topology_sync_interval)
+    mc.setTemperatureWindow(temperature_window)
+    mc.setMaxParallelCommands(max_parallel_commands)
+    mc.setTelemetrySize(telemetry_size)
+
+    #Devices and contextKey from the previous run (Revalidated in background)
+    store = Store(hass, STORAGE_VERSION, STORAGE_KEY + "." + hashlib.sha1(email.encode()).hexdigest()[:10])
+    cache = await store.async_load()
+
+    devices = []
+    if cache != None:
+        devices = mc.loadCache(cache)
+        _LOGGER.debug("melcloud: " + str(len(devices)) + " device(s) loaded from cache")
+
+    if not mcauth.isLogin():
+        if await mcauth.async_login() == False and len(devices) == 0:
+            _LOGGER.error("melcloud: Invalid Login/Password  ! (" + email + ")")
+            await mcauth.async_close()
+            accounts.pop(email)
+            return False
 
-# ---------------------------------------------------------------
+    telemetry_store = None
+    if telemetry_persist and telemetry_size > 0:
+        telemetry_store = Store(hass, STORAGE_VERSION, STORAGE_TELEMETRY_KEY + "." + hashlib.sha1(email.encode()).hexdigest()[:10])
+
+    async def async_close(event):
+        await mc.async_stopPolling()
+        await store.async_save(mc.getCacheData())
+        if telemetry_store != None:
+            await telemetry_store.async_save(mc.getTelemetryData())
+        await mcauth.async_close()
+
+    last_save_time_s = {} #Store => last save
+
+    def save_throttled(target, data):
+        #Not async_delay_save: its timer is re-armed on each call, polled more often than STORAGE_SAVE_DELAY it would never fire
+        now = time.time()
+        if now - last_save_time_s.get(target, 0) >= STORAGE_SAVE_DELAY:
+            last_save_time_s[target] = now
+            hass.async_create_task(target.async_save(data()))
+
+    def save():
+        save_throttled(store, mc.getCacheData)
+        if telemetry_store != None:
+            save_throttled(telemetry_store, mc.getTelemetryData)
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_close)
+    mc.addRefreshListener(save)
+
+    revalidate = len(devices) > 0
+    if not revalidate:
+        devices = await mc.async_getDevicesList()
+
+    if telemetry_store != None:
+        telemetry = await telemetry_store.async_load()
+        if telemetry != None:
+            mc.loadTelemetry(telemetry)
+
+    entities = {}
+    skipped = {} #Devices without state yet (Device/Get failed), state is fetched again by the next topology sync
+
+    def add_entities(devices):
+        added = []
+        for device in devices:
+            if not device.getState().valid:
+                _LOGGER.warning("melcloud: No state for device " + device.getFriendlyName() + ", will retry")
+                skipped[device.getID()] = device
+                continue
+
+            _LOGGER.debug("melcloud: Adding new device: " + device.getFriendlyName())
+            skipped.pop(device.getID(), None)
+            entities[device.getID()] = MelCloudClimate(device)
+            added.append(entities[device.getID()])
+
+        if len(added) > 0:
+            async_add_entities(added)
+
+    def add_skipped():
+        if any(device.getState().valid for device in skipped.values()):
+            add_entities(list(skipped.values()))
+
+    add_entities(devices)
+    mc.addRefreshListener(add_skipped)
+
+    async def async_update_entities(added, removed):
+        #Existing entities (And their devices state) are left untouched
+        add_entities(added)
+
+        for device in removed:
+            _LOGGER.debug("melcloud: Removing device: " + device.getFriendlyName())
+            skipped.pop(device.getID(), None)
+            if device.getID() in entities:
+                await entities.pop(device.getID()).async_remove()
+
+        await store.async_save(mc.getCacheData())
+
+    mc.addTopologyListener(async_update_entities)
+
+    async def async_revalidate():
+        added, removed = await mc.async_syncDevices()
+        if added == None:
+            _LOGGER.warning("melcloud: Unable to revalidate cached devices")
+            return
 
-if __name__ == '__main__':
+        await async_update_entities(added, removed)
 
-    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    if revalidate:
+        hass.async_create_task(async_revalidate())
 
-    if len(sys.argv) < 3:
-        print ("Usage: " + sys.argv[0] + " <email> <password>")
-        sys.exit(1)
+    #Diagnostic sensors (See sensor.py), the account is passed as discovery info
+    #Last argument is the HomeAssistant configuration, kept by the component setup (See __init__.py)
+    accounts[email] = mc
+    hass.async_create_task(async_load_platform(hass, "sensor", DOMAIN, {CONF_EMAIL: email, CONF_ACCOUNTS: multiple}, hass.data[DATA_HASS_CONFIG]))
 
-    mcauth = MelCloudAuthentication(sys.argv[1], sys.argv[2])
-    if mcauth.login() == False:
-        print("Invalid Login/Password  !")
-        sys.exit(1)
-    
-    #mcauth._contextkey = "000000000000000"
-    mc = MelCloud(mcauth)
+    mc.startPolling()
     
-    devices = mc.getDevicesList()
-    for device in  devices:
-        print (device)
-        #device.powerOff()
-        #device.apply() 
-
+    _LOGGER.debug("melcloud: Account " + email + " added ! (" + str(len(entities)) + " device(s) found !)")
+    return True
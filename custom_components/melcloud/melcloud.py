@@ -0,0 +1,2022 @@
+#!/usr/local/bin/python3
+
+"""
+    Author: o0Zz
+
+    MELCloud API client, without Home Assistant dependency (The climate and sensor platforms are built on it)
+    requests and aiohttp are only imported on first use: importing this module is fast and needs nothing but the standard library
+
+    Documentation:
+        Reverse: http://mgeek.fr/blog/un-peu-de-reverse-engineering-sur-melcloud
+
+    Usage:
+        python3 melcloud.py snapshot --account <email> <password> [--account ...] [--format jsonl|csv] [--output FILE]
+        python3 melcloud.py apply --accounts accounts.json --commands commands.jsonl [--dry-run] [--parallel N]
+
+        from melcloud import MelCloudAuthentication, MelCloud
+        mcauth = MelCloudAuthentication(email, password)
+        mcauth.login()
+        devices = MelCloud(mcauth).getDevicesList()
+
+    Workflow:
+        Devices states are refreshed all together: one ListDevices request per poll cycle for the whole account (Instead of one Device/Get per device)
+
+        MelCloudAuthenticationAsync/MelCloudAsync/MelCloudDeviceAsync run on an asyncio event loop (Home Assistant),
+        the synchronous API (MelCloudAuthentication/MelCloud/MelCloudDevice) is kept for scripts
+
+        Once we successfully login, we will retrive the "contextKey" and we will use this auth to all our requests
+        If an error 401 occured, it means contextKey has expired, in this case we will re-login (Only once, concurrent requests wait for it and are replayed)
+        The contextKey is also renewed before its expiry (Expiry returned by the login)
+        On connection error, timeout or 5xx we retry with exponential backoff, after too many failures a circuit breaker
+        stop sending requests for a while (Devices keep their last known state)
+        If any other error occured, we will abort.
+    
+    License:
+                DO WHAT THE FUCK YOU WANT TO PUBLIC LICENSE 
+                        Version 2, December 2004
+        
+        Everyone is permitted to copy and distribute verbatim or modified
+        copies of this license document, and changing it is allowed as long
+        as the name is changed.
+                  
+                  DO WHAT THE FUCK YOU WANT TO PUBLIC LICENSE
+          TERMS AND CONDITIONS FOR COPYING, DISTRIBUTION AND MODIFICATION
+          
+         0. You just DO WHAT THE FUCK YOU WANT TO.
+"""
+
+import asyncio
+import sys
+import logging
+import time
+import json
+import threading
+import urllib.parse
+import random
+import datetime
+import array
+import math
+import bisect
+import copy
+
+_LOGGER = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5 #seconds
+DEFAULT_TIMEOUT = 20 #seconds
+DEFAULT_MAX_PARALLEL_REQUESTS = 4
+DEFAULT_MAX_PARALLEL_COMMANDS = 10 #Group commands, per account
+DEFAULT_COMMAND_DEBOUNCE = 0.5 #seconds
+DEFAULT_INFO_TTL = 60 #seconds
+DEFAULT_MAX_STALENESS = 600 #seconds
+DEFAULT_FAST_POLL_INTERVAL = 15 #seconds, right after a command or a state change
+DEFAULT_POLL_INTERVAL = 60 #seconds
+DEFAULT_IDLE_POLL_INTERVAL = 300 #seconds, when all devices are off or offline
+DEFAULT_TOPOLOGY_SYNC_INTERVAL = 600 #seconds, new and removed devices are picked up by the poll at this interval
+DEFAULT_COMMAND_CONFIRM_GRACE = 30 #seconds, commanded values are held this long even if melcloud doesn't report a pending command yet
+DEFAULT_COMMAND_TIMEOUT = 300 #seconds, commanded values not confirmed by melcloud after this time are rolled back
+DEFAULT_TEMPERATURE_WINDOW = 600 #seconds, room temperature is averaged over this window
+DEFAULT_TEMPERATURE_SLOTS = 20 #Room temperature samples kept over the window (At most one per window / slots)
+DEFAULT_TELEMETRY_SIZE = 1440 #Samples kept per device (24h at 60s poll interval), 0 to disable
+DEFAULT_TELEMETRY_BUCKET = 3600 #seconds, downsampled statistics
+DEFAULT_ACTIVITY_WINDOW = 120 #seconds, a device is considered active during this time after a command or a state change
+DEFAULT_RETRY_AFTER = 60 #seconds, when melcloud rate limit us without Retry-After
+CONTEXTKEY_RENEW_MARGIN = 3600 #seconds, contextKey is renewed this time before its expiry
+DEFAULT_MAX_RETRIES = 3 #On connection error, timeout or 5xx
+DEFAULT_BACKOFF = 0.5 #seconds, doubled on each retry
+DEFAULT_MAX_BACKOFF = 8 #seconds
+DEFAULT_BREAKER_THRESHOLD = 5 #Consecutive failed requests before opening the circuit breaker
+DEFAULT_BREAKER_RESET_TIMEOUT = 60 #seconds, circuit breaker stay open during this time
+
+MELCLOUD_URL = "https://app.melcloud.com/Mitsubishi.Wifi.Client"
+
+# ---------------------------------------------------------------
+
+class Language:
+    English = 0
+    German = 4
+    Spanish = 6
+    French = 7
+    Italian = 19
+    
+# ---------------------------------------------------------------
+
+class Mode:
+    Heat = 1
+    Dry = 2
+    Cool = 3
+    Fan = 7
+    Auto = 8
+
+# ---------------------------------------------------------------
+
+class VentilationMode:
+    EnergyRecovery = 0
+    ByPass = 1
+    Auto = 2
+
+# ---------------------------------------------------------------
+
+class DeviceType:
+    Conditioner = 0
+    Vent = 3
+
+# ---------------------------------------------------------------
+
+class EffectiveFlags:
+    Power = 0x01
+    OperationMode = 0x02
+    Temperature = 0x04
+    VentilationMode = 0x04 #SetErv only
+    FanSpeed = 0x08
+    VaneVertical = 0x10
+    VaneHorizontal = 0x100
+
+    #Device/Get key => flag to signal melcloud this key has changed
+    Conditioner = {"Power": Power, "OperationMode": OperationMode, "SetTemperature": Temperature, "SetFanSpeed": FanSpeed, "VaneVertical": VaneVertical, "VaneHorizontal": VaneHorizontal}
+    Vent = {"Power": Power, "VentilationMode": VentilationMode, "SetFanSpeed": FanSpeed}
+
+# ---------------------------------------------------------------
+
+class MelCloudDeviceState:
+    #Only the fields used by the integration, parsed once per refresh
+    __slots__ = ("valid", "deviceType", "power", "offline", "mode", "ventMode", "temperature", "roomTemperature", "fanSpeed", "fanSpeedMax", "verticalSwingMode", "horizontalSwingMode", "energyMeter")
+
+    #Device/Get key => attribute
+    KEYS = {
+        "DeviceType": "deviceType",
+        "Power": "power",
+        "Offline": "offline",
+        "OperationMode": "mode",
+        "VentilationMode": "ventMode",
+        "SetTemperature": "temperature",
+        "RoomTemperature": "roomTemperature",
+        "SetFanSpeed": "fanSpeed",
+        "NumberOfFanSpeeds": "fanSpeedMax",
+        "VaneVertical": "verticalSwingMode",
+        "VaneHorizontal": "horizontalSwingMode",
+        "HasEnergyConsumedMeter": "energyMeter"
+    }
+
+    def __init__(self):
+        self.reset()
+
+    def __str__(self):
+        return str(self.toDict())
+
+    def reset(self):
+        self.valid = False
+        self.deviceType = None
+        self.power = False
+        self.offline = False
+        self.mode = Mode.Auto
+        self.ventMode = VentilationMode.Auto
+        self.temperature = None
+        self.roomTemperature = None
+        self.fanSpeed = None
+        self.fanSpeedMax = None
+        self.verticalSwingMode = None
+        self.horizontalSwingMode = None
+        self.energyMeter = None #Unknown (Not reported)
+
+    def update(self, json):
+        self.reset()
+
+        for key, attr in self.KEYS.items():
+            if key in json:
+                setattr(self, attr, json[key])
+
+        self.valid = True
+
+    def get(self, key):
+        return getattr(self, self.KEYS[key])
+
+    def set(self, key, value):
+        setattr(self, self.KEYS[key], value)
+
+    def toDict(self):
+        return {key: getattr(self, attr) for key, attr in self.KEYS.items()}
+
+    def fingerprint(self):
+        #Cheap value to compare states
+        return tuple(getattr(self, attr) for attr in self.__slots__)
+
+# ---------------------------------------------------------------
+
+class MelCloudTemperatureStats:
+    #Time-aware ring buffer: the window is split in fixed time slots, one sample kept per slot (The last one),
+    #so forced refreshes don't weight more than regular polls. Sum and count are kept up to date, min/max/trend
+    #are computed once per new sample
+
+    def __init__(self, window_seconds = DEFAULT_TEMPERATURE_WINDOW, slots = DEFAULT_TEMPERATURE_SLOTS):
+        self._slot_s = float(window_seconds) / slots
+        self._values = [None] * slots
+        self._slots = [None] * slots #Slot number of each value
+        self._last_slot = None
+        self._sum = 0.0
+        self._count = 0
+        self._stats = None
+
+    def _expire(self, slot):
+        #Clear slots gone out of the window since last call (At most the ring size)
+        if self._last_slot != None and slot > self._last_slot:
+            for expired in range(max(self._last_slot + 1, slot - len(self._values) + 1), slot + 1):
+                index = expired % len(self._values)
+                if self._values[index] != None:
+                    self._sum -= self._values[index]
+                    self._count -= 1
+                    self._values[index] = None
+                    self._slots[index] = None
+                    self._stats = None
+
+            if self._count == 0:
+                self._sum = 0.0 #No float drift carried over
+
+        if self._last_slot == None or slot > self._last_slot:
+            self._last_slot = slot
+
+    def add(self, value, time_s):
+        slot = int(time_s // self._slot_s)
+        self._expire(slot)
+
+        index = slot % len(self._values)
+        if self._slots[index] == slot:
+            self._sum -= self._values[index] #Same slot: the new sample replace the previous one
+        else:
+            self._count += 1
+
+        self._values[index] = value
+        self._slots[index] = slot
+        self._sum += value
+        self._stats = None
+
+    def getMean(self, time_s = None):
+        self._expire(int((time.time() if time_s == None else time_s) // self._slot_s))
+        if self._count == 0:
+            return None
+
+        return round(self._sum / self._count, 1)
+
+    def getStats(self, time_s = None):
+        #min, max, mean and trend (Degrees per hour, least squares over the window)
+        mean = self.getMean(time_s)
+        if mean == None:
+            return {"min": None, "max": None, "mean": None, "trend": None}
+
+        if self._stats == None:
+            samples = [(slot * self._slot_s, value) for slot, value in zip(self._slots, self._values) if value != None]
+            values = [value for slot_s, value in samples]
+
+            trend = None
+            if len(samples) > 1:
+                mean_s = sum(slot_s for slot_s, value in samples) / len(samples)
+                mean_value = self._sum / self._count
+                variance = sum((slot_s - mean_s) ** 2 for slot_s, value in samples)
+                if variance > 0:
+                    trend = round(sum((slot_s - mean_s) * (value - mean_value) for slot_s, value in samples) / variance * 3600, 2)
+
+            self._stats = {"min": min(values), "max": max(values), "trend": trend}
+
+        return dict(self._stats, mean = mean)
+
+# ---------------------------------------------------------------
+
+class MelCloudTelemetry:
+    #Per device history recorded on each refresh (No extra request), fixed size ring of arrays (Oldest samples are overwritten)
+    #Missing values are stored as NaN
+
+    #Field => Device/Get key
+    FIELDS = {
+        "room_temperature": "RoomTemperature",
+        "temperature": "SetTemperature",
+        "power": "Power",
+        "mode": "OperationMode",
+        "energy": "CurrentEnergyConsumed"
+    }
+
+    def __init__(self, size = DEFAULT_TELEMETRY_SIZE):
+        self._size = size
+        self._times = array.array("d", [math.nan]) * size
+        self._values = {field: array.array("f", [math.nan]) * size for field in self.FIELDS} #float32 is enough for these values
+        self.clear()
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, time_s, json):
+        index = self._next
+        self._times[index] = time_s
+        for field, key in self.FIELDS.items():
+            value = json.get(key)
+            self._values[field][index] = math.nan if value == None else float(value)
+
+        self._next = (index + 1) % self._size
+        self._count = min(self._count + 1, self._size)
+
+    def _indexes(self, since_s = 0):
+        #Oldest to newest
+        for i in range(self._next - self._count, self._next):
+            index = i % self._size
+            if self._times[index] >= since_s:
+                yield index
+
+    def getLast(self, field):
+        if self._count == 0:
+            return None
+
+        value = self._values[field][(self._next - 1) % self._size]
+        return None if math.isnan(value) else value
+
+    def getSeries(self, field, since_s = 0):
+        #[(time, value)]
+        values = self._values[field]
+        return [(self._times[index], values[index]) for index in self._indexes(since_s) if not math.isnan(values[index])]
+
+    def getDownsampled(self, field, bucket_seconds, since_s = 0):
+        #[{time, min, max, mean}] one entry per bucket with samples
+        buckets = {}
+        for time_s, value in self.getSeries(field, since_s):
+            bucket = buckets.setdefault(int(time_s // bucket_seconds), [value, value, 0.0, 0])
+            bucket[0] = min(bucket[0], value)
+            bucket[1] = max(bucket[1], value)
+            bucket[2] += value
+            bucket[3] += 1
+
+        return [{"time": bucket * bucket_seconds, "min": round(low, 2), "max": round(high, 2), "mean": round(total / count, 2)} for bucket, (low, high, total, count) in sorted(buckets.items())]
+
+    def toDict(self):
+        #Compact, JSON friendly (See loadDict)
+        indexes = list(self._indexes())
+        data = {"times": [self._times[index] for index in indexes]}
+        for field, values in self._values.items():
+            data[field] = [None if math.isnan(values[index]) else values[index] for index in indexes]
+        return data
+
+    def _add_dict(self, data, after_s):
+        for i, time_s in enumerate(data.get("times", [])):
+            if time_s > after_s:
+                self.add(time_s, {key: data[field][i] for field, key in self.FIELDS.items() if field in data})
+
+    def loadDict(self, data):
+        #Samples recorded since startup are kept after the loaded ones
+        current = self.toDict()
+        self.clear()
+        self._add_dict(data, 0)
+        self._add_dict(current, self._times[(self._next - 1) % self._size] if self._count > 0 else 0)
+
+# ---------------------------------------------------------------
+
+class MelCloudMetrics:
+    #Latency histogram buckets upper bounds (seconds)
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self._devices = {}
+            self._counters = {"login": 0, "relogin": 0, "retry": 0, "rate_limited": 0, "short_circuited": 0}
+
+    def addHook(self, hook):
+        #hook(event, data) is called for every recorded event ("request", "counter", "device")
+        self._hooks.append(hook)
+        return lambda: self._hooks.remove(hook)
+
+    def _notify(self, event, data):
+        for hook in list(self._hooks):
+            try:
+                hook(event, data)
+            except Exception as e:
+                _LOGGER.error("Metrics hook failed: " + str(e))
+
+    def _get_endpoint(self, url):
+        #Ex: https://app.melcloud.com/Mitsubishi.Wifi.Client/Device/Get => Device/Get
+        return "/".join(urllib.parse.urlparse(url).path.split("/")[-2:])
+
+    def recordRequest(self, url, status_code, latency_s, request_bytes, response_bytes):
+        endpoint = self._get_endpoint(url)
+
+        with self._lock:
+            if endpoint not in self._endpoints:
+                self._endpoints[endpoint] = {"calls": 0, "errors": 0, "status": {}, "latency_sum": 0.0, "latency_buckets": [0] * len(self.LATENCY_BUCKETS), "request_bytes": 0, "response_bytes": 0}
+
+            stats = self._endpoints[endpoint]
+            stats["calls"] += 1
+            if status_code != 200:
+                stats["errors"] += 1
+            stats["status"][str(status_code)] = stats["status"].get(str(status_code), 0) + 1
+            stats["latency_sum"] += latency_s
+            stats["latency_buckets"][bisect.bisect_left(self.LATENCY_BUCKETS, latency_s)] += 1
+            stats["request_bytes"] += request_bytes
+            stats["response_bytes"] += response_bytes
+
+        self._notify("request", {"endpoint": endpoint, "status": status_code, "latency": latency_s, "request_bytes": request_bytes, "response_bytes": response_bytes})
+
+    def recordCounter(self, name):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+
+        self._notify("counter", {"name": name})
+
+    def recordDevice(self, deviceid, operation, success, latency_s):
+        with self._lock:
+            stats = self._devices.setdefault(deviceid, {})
+            if operation not in stats:
+                stats[operation] = {"calls": 0, "errors": 0, "latency_sum": 0.0, "latency_max": 0.0}
+
+            stats = stats[operation]
+            stats["calls"] += 1
+            if not success:
+                stats["errors"] += 1
+            stats["latency_sum"] += latency_s
+            stats["latency_max"] = max(stats["latency_max"], latency_s)
+
+        self._notify("device", {"device": deviceid, "operation": operation, "success": success, "latency": latency_s})
+
+    def getSnapshot(self):
+        with self._lock:
+            return copy.deepcopy({"endpoints": self._endpoints, "devices": self._devices, "counters": self._counters})
+
+    def getLatencyPercentile(self, percent):
+        #Upper bound of the bucket holding the percentile, all endpoints
+        with self._lock:
+            buckets = [sum(stats["latency_buckets"][i] for stats in self._endpoints.values()) for i in range(len(self.LATENCY_BUCKETS))]
+
+        total = sum(buckets)
+        if total == 0:
+            return None
+
+        count = 0
+        for bucket, value in zip(self.LATENCY_BUCKETS, buckets):
+            count += value
+            if count >= total * percent / 100.0:
+                return bucket
+
+        return self.LATENCY_BUCKETS[-1]
+
+# ---------------------------------------------------------------
+
+class MelCloudCircuitBreaker:
+    Closed = "closed"
+    Open = "open"
+    HalfOpen = "half_open"
+
+    def __init__(self, failure_threshold = DEFAULT_BREAKER_THRESHOLD, reset_timeout_s = DEFAULT_BREAKER_RESET_TIMEOUT):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout_s = reset_timeout_s
+        self._lock = threading.Lock()
+        self._state = self.Closed
+        self._failures = 0
+        self._opened_time_s = 0
+        self._trial_running = False
+
+    def getState(self):
+        return self._state
+
+    def allowRequest(self):
+        with self._lock:
+            if self._state == self.Open and (time.time() - self._opened_time_s) >= self._reset_timeout_s:
+                self._state = self.HalfOpen
+                self._trial_running = False
+
+            if self._state == self.Closed:
+                return True
+
+            #Half open: a single trial request decide if we close or re-open the circuit
+            if self._state == self.HalfOpen and not self._trial_running:
+                self._trial_running = True
+                return True
+
+            return False
+
+    def recordResult(self, success):
+        with self._lock:
+            if success:
+                if self._state != self.Closed:
+                    _LOGGER.info("MELCloud is back, circuit breaker closed")
+                self._state = self.Closed
+                self._failures = 0
+                return
+
+            self._failures += 1
+            if self._state == self.HalfOpen or self._failures >= self._failure_threshold:
+                if self._state != self.Open:
+                    _LOGGER.warning("MELCloud is failing, circuit breaker open for " + str(self._reset_timeout_s) + "s")
+                self._state = self.Open
+                self._opened_time_s = time.time()
+                self._trial_running = False
+
+# ---------------------------------------------------------------
+
+class MelCloudAuthentication:
+    def __init__(self, email, password, language = Language.English, pool_size = DEFAULT_POOL_SIZE, connect_timeout = DEFAULT_CONNECT_TIMEOUT, timeout = DEFAULT_TIMEOUT, base_url = MELCLOUD_URL):
+        self._email = email
+        self._base_url = base_url
+        self._password = password
+        self._language = language
+        self._contextkey = None
+        self._contextkey_expiry_s = None
+        self._pool_size = pool_size
+        self._timeout = (connect_timeout, timeout)
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._retry_after_time_s = 0 #Rate limited by melcloud until this time
+        self._metrics = MelCloudMetrics()
+        self._login_lock = threading.Lock() #Only one login at a time, concurrent requests wait for it
+        self._renew_time_s = 0 #Last contextKey renewal attempt
+        self._circuit_breaker = MelCloudCircuitBreaker()
+        self.setRetryPolicy(DEFAULT_MAX_RETRIES, DEFAULT_BACKOFF, DEFAULT_MAX_BACKOFF)
+
+    def _get_session(self):
+        #Single keep-alive session shared by all requests (Avoid a TCP+TLS handshake per request)
+        with self._session_lock:
+            if self._session == None:
+                import requests #Imported on first use (See module documentation)
+                from requests.adapters import HTTPAdapter
+
+                self._session = requests.Session()
+                self._session.mount("https://", HTTPAdapter(pool_connections = 1, pool_maxsize = self._pool_size))
+                self._session.mount("http://", HTTPAdapter(pool_connections = 1, pool_maxsize = self._pool_size))
+            
+            return self._session
+
+    def close(self):
+        with self._session_lock:
+            if self._session != None:
+                _LOGGER.debug("Closing session ...")
+                self._session.close()
+                self._session = None
+
+    def getMetrics(self):
+        return self._metrics
+
+    def getCircuitBreaker(self):
+        return self._circuit_breaker
+
+    def setRetryPolicy(self, max_retries, backoff_seconds, max_backoff_seconds = DEFAULT_MAX_BACKOFF):
+        self._max_retries = max_retries
+        self._backoff_s = backoff_seconds
+        self._max_backoff_s = max_backoff_seconds
+
+    def _encode_data(self, data):
+        if data == None:
+            return None
+
+        #Same form encoding as requests (None values are dropped)
+        return urllib.parse.urlencode([(key, value) for key, value in data.items() if value != None], doseq = True)
+
+    def _get_headers(self, contextkey):
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        if contextkey != None: #Not logged in: melcloud reply 401 and we re-login (aiohttp refuse None headers)
+            headers['X-MitsContextKey'] = contextkey
+        return headers
+
+    def _set_rate_limited(self, url, retry_after):
+        try:
+            retry_after = int(retry_after)
+        except (TypeError, ValueError):
+            retry_after = DEFAULT_RETRY_AFTER
+
+        _LOGGER.warning("Rate limited on URL: '" + str(url) + "', retry after " + str(retry_after) + "s")
+        self._metrics.recordCounter("rate_limited")
+        self._retry_after_time_s = time.time() + retry_after
+
+    def getRetryAfter(self):
+        #Seconds to wait before sending a new request (Rate limited by melcloud)
+        return max(0, self._retry_after_time_s - time.time())
+
+    def getUrl(self, path):
+        return self._base_url + path
+
+    def isLogin(self):
+        return self._contextkey != None
+        
+    def _get_login_data(self):
+        return {"Email": self._email ,"Password": self._password, "Language": self._language, "AppVersion": "1.15.3.0", "Persist": False}
+
+    def _parse_expiry(self, expiry):
+        #Ex: "2020-06-15T20:05:37.4"
+        try:
+            return datetime.datetime.strptime(expiry[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo = datetime.timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            return None
+
+    def _handle_login_reply(self, status_code, reply):
+        if status_code == 200:
+            if "ErrorId" in reply and reply["ErrorId"] == None:
+                self._metrics.recordCounter("login")
+                self._contextkey = reply["LoginData"]["ContextKey"]
+                self._contextkey_expiry_s = self._parse_expiry(reply["LoginData"].get("Expiry"))
+                return True
+            else:
+                _LOGGER.error("Login/Password invalid ! ")
+
+        else:
+            _LOGGER.error("Login status code invalid: " + str(status_code))
+
+        return False
+
+    def _is_renew_needed(self):
+        if self._contextkey_expiry_s == None or (time.time() - self._renew_time_s) < DEFAULT_RETRY_AFTER:
+            return False
+
+        return time.time() >= (self._contextkey_expiry_s - CONTEXTKEY_RENEW_MARGIN)
+
+    def _start_renew(self):
+        self._renew_time_s = time.time()
+
+    def _complete_renew(self, success):
+        if not success:
+            #Current contextKey is still valid until its expiry
+            _LOGGER.warning("Unable to renew contextKey")
+
+    def _renew(self, contextkey):
+        with self._login_lock:
+            if not self._is_relogin_needed(contextkey) or not self._is_renew_needed():
+                return
+
+            self._start_renew()
+            self._complete_renew(self._login(renew = True))
+
+    def _is_relogin_needed(self, contextkey):
+        #False if another request already got a new contextKey (Since contextkey was used)
+        return self._contextkey == None or self._contextkey == contextkey
+
+    def _relogin(self, contextkey):
+        with self._login_lock:
+            if not self._is_relogin_needed(contextkey):
+                return True
+
+            return self._login()
+
+    def login(self):
+        with self._login_lock:
+            return self._login()
+
+    def _login(self, renew = False):
+        _LOGGER.debug("Login ...")
+
+        #On renew, requests sent meanwhile keep using the current contextKey (Replaced once the new one is received)
+        if not renew:
+            self._contextkey = None
+            self._contextkey_expiry_s = None
+        
+        url = self.getUrl("/Login/ClientLogin")
+        if not self._allow_request(url):
+            return False
+
+        status_code, content, retry_after = self._send_retry("POST", url, {'Content-Type': 'application/x-www-form-urlencoded'}, self._encode_data(self._get_login_data()))
+        self._circuit_breaker.recordResult(not self._is_transient(status_code))
+        return self._handle_login_reply(status_code, json.loads(content) if status_code == 200 else None)
+        
+    def getContextKey(self):
+        return self._contextkey
+
+    def getContextKeyExpiry(self):
+        return self._contextkey_expiry_s
+
+    def setContextKey(self, contextkey, expiry_s):
+        #Restore a previous session (See MelCloud.loadCache)
+        if expiry_s != None and expiry_s <= time.time():
+            return False
+
+        self._contextkey = contextkey
+        self._contextkey_expiry_s = expiry_s
+        return True
+        
+    def _send(self, method, url, headers, body):
+        import requests
+        #Return status code (None on connection error/timeout), content and Retry-After
+        start_s = time.perf_counter()
+        try:
+            req = self._get_session().request(method, url, headers = headers, data = body, timeout = self._timeout)
+        except requests.exceptions.RequestException as e:
+            self._metrics.recordRequest(url, None, time.perf_counter() - start_s, len(body or ""), 0)
+            _LOGGER.error("Unable to URL: '" + str(url) + "' (" + str(e) + ")")
+            return None, None, None
+
+        self._metrics.recordRequest(url, req.status_code, time.perf_counter() - start_s, len(body or ""), len(req.content))
+        return req.status_code, req.content, req.headers.get("Retry-After")
+
+    def _is_transient(self, status_code):
+        return status_code == None or status_code >= 500
+
+    def _get_backoff(self, attempt):
+        #Exponential backoff with full jitter
+        return random.uniform(0, min(self._max_backoff_s, self._backoff_s * (2 ** (attempt - 1))))
+
+    def _send_retry(self, method, url, headers, body):
+        for attempt in range(self._max_retries + 1):
+            if attempt > 0:
+                self._metrics.recordCounter("retry")
+                time.sleep(self._get_backoff(attempt))
+
+            status_code, content, retry_after = self._send(method, url, headers, body)
+            if not self._is_transient(status_code):
+                break
+
+        return status_code, content, retry_after
+
+    def _can_send(self, url, retry):
+        if retry > 1:
+            return False
+
+        if self.getRetryAfter() > 0:
+            _LOGGER.debug("Rate limited, request skipped: '" + str(url) + "'")
+            return False
+
+        return self._allow_request(url)
+
+    def _allow_request(self, url):
+        if not self._circuit_breaker.allowRequest():
+            #MELCloud is failing, don't hammer it: callers keep serving their cached state
+            _LOGGER.debug("Circuit breaker open, request skipped: '" + str(url) + "'")
+            self._metrics.recordCounter("short_circuited")
+            return False
+
+        return True
+
+    def _handle_reply(self, url, status_code, content, retry_after, decode = json.loads):
+        #Return success, json, relogin needed
+        self._circuit_breaker.recordResult(not self._is_transient(status_code))
+
+        if status_code == 200:
+            # _LOGGER.debug(content)
+            return True, decode(content), False
+
+        elif status_code == 401:
+            _LOGGER.error("Unable to URL: '" + str(url) + "', error 401 (Try to re-login...)")
+            self._metrics.recordCounter("relogin")
+            return False, None, True
+        elif status_code == 429:
+            self._set_rate_limited(url, retry_after)
+        elif status_code != None:
+            _LOGGER.error("Unable to retrieve information from URL: '" + str(url) + "' (Invalid status code: " + str(status_code) + ")")
+
+        return False, None, False
+
+    def sendReq(self, method, url, data = None, retry = 0, decode = json.loads):
+        if not self._can_send(url, retry):
+            return False, None
+
+        if self._is_renew_needed():
+            _LOGGER.info("ContextKey is about to expire, renewing...")
+            self._renew(self.getContextKey())
+
+        contextkey = self.getContextKey()
+        headers = self._get_headers(contextkey)
+        body = self._encode_data(data)
+
+        status_code, content, retry_after = self._send_retry(method, url, headers, body)
+        success, reply, relogin = self._handle_reply(url, status_code, content, retry_after, decode)
+        if relogin and self._relogin(contextkey):
+            return self.sendReq(method, url, data, retry + 1, decode)
+
+        return success, reply
+        
+# ---------------------------------------------------------------
+
+class MelCloudAuthenticationAsync(MelCloudAuthentication):
+    def __init__(self, email, password, language = Language.English, pool_size = DEFAULT_POOL_SIZE, connect_timeout = DEFAULT_CONNECT_TIMEOUT, timeout = DEFAULT_TIMEOUT, base_url = MELCLOUD_URL):
+        super().__init__(email, password, language, pool_size, connect_timeout, timeout, base_url)
+        self._async_session = None
+        self._async_login_lock = None
+
+    def _get_async_session(self):
+        #Same as the sync session: a single keep-alive connection pool, but on the event loop
+        if self._async_session == None:
+            import aiohttp #Imported on first use (See module documentation)
+
+            self._async_session = aiohttp.ClientSession(
+                connector = aiohttp.TCPConnector(limit = self._pool_size),
+                timeout = aiohttp.ClientTimeout(sock_connect = self._timeout[0], sock_read = self._timeout[1]))
+
+        return self._async_session
+
+    async def async_close(self):
+        if self._async_session != None:
+            _LOGGER.debug("Closing async session ...")
+            await self._async_session.close()
+            self._async_session = None
+
+        self.close()
+
+    def _get_async_login_lock(self):
+        if self._async_login_lock == None:
+            self._async_login_lock = asyncio.Lock()
+
+        return self._async_login_lock
+
+    async def _async_relogin(self, contextkey):
+        async with self._get_async_login_lock():
+            if not self._is_relogin_needed(contextkey):
+                return True
+
+            return await self._async_login()
+
+    async def _async_renew(self, contextkey):
+        async with self._get_async_login_lock():
+            if not self._is_relogin_needed(contextkey) or not self._is_renew_needed():
+                return
+
+            self._start_renew()
+            self._complete_renew(await self._async_login(renew = True))
+
+    async def async_login(self):
+        async with self._get_async_login_lock():
+            return await self._async_login()
+
+    async def _async_login(self, renew = False):
+        _LOGGER.debug("Login ...")
+
+        #Same as _login
+        if not renew:
+            self._contextkey = None
+            self._contextkey_expiry_s = None
+
+        url = self.getUrl("/Login/ClientLogin")
+        if not self._allow_request(url):
+            return False
+
+        status_code, content, retry_after = await self._async_send_retry("POST", url, {'Content-Type': 'application/x-www-form-urlencoded'}, self._encode_data(self._get_login_data()))
+        self._circuit_breaker.recordResult(not self._is_transient(status_code))
+        return self._handle_login_reply(status_code, json.loads(content) if status_code == 200 else None)
+
+    async def _async_send(self, method, url, headers, body):
+        import aiohttp
+        start_s = time.perf_counter()
+        try:
+            async with self._get_async_session().request(method, url, headers = headers, data = body) as req:
+                content = await req.read()
+                status_code = req.status
+                retry_after = req.headers.get("Retry-After")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._metrics.recordRequest(url, None, time.perf_counter() - start_s, len(body or ""), 0)
+            _LOGGER.error("Unable to URL: '" + str(url) + "' (" + str(e) + ")")
+            return None, None, None
+
+        self._metrics.recordRequest(url, status_code, time.perf_counter() - start_s, len(body or ""), len(content))
+        return status_code, content, retry_after
+
+    async def _async_send_retry(self, method, url, headers, body):
+        for attempt in range(self._max_retries + 1):
+            if attempt > 0:
+                self._metrics.recordCounter("retry")
+                await asyncio.sleep(self._get_backoff(attempt))
+
+            status_code, content, retry_after = await self._async_send(method, url, headers, body)
+            if not self._is_transient(status_code):
+                break
+
+        return status_code, content, retry_after
+
+    async def async_sendReq(self, method, url, data = None, retry = 0, decode = json.loads):
+        if not self._can_send(url, retry):
+            return False, None
+
+        if self._is_renew_needed():
+            _LOGGER.info("ContextKey is about to expire, renewing...")
+            await self._async_renew(self.getContextKey())
+
+        contextkey = self.getContextKey()
+        headers = self._get_headers(contextkey)
+        body = self._encode_data(data)
+
+        status_code, content, retry_after = await self._async_send_retry(method, url, headers, body)
+        success, reply, relogin = self._handle_reply(url, status_code, content, retry_after, decode)
+        if relogin and await self._async_relogin(contextkey):
+            return await self.async_sendReq(method, url, data, retry + 1, decode)
+
+        return success, reply
+
+# ---------------------------------------------------------------
+
+class MelCloudDevice:
+
+    def __init__(self, deviceid, buildingid, friendlyname, authentication, cloud = None, json = None, info_ttl_seconds = DEFAULT_INFO_TTL, max_staleness_seconds = DEFAULT_MAX_STALENESS, temperature_window_seconds = DEFAULT_TEMPERATURE_WINDOW, telemetry_size = 0):
+        self._deviceid = deviceid
+        self._buildingid = buildingid
+        self._friendlyname = friendlyname
+        self._authentication = authentication
+        self._cloud = cloud #When set, device info come from the account-wide snapshot (See MelCloud.refreshDevices)
+        self._info_lease_seconds = info_ttl_seconds #Data are fresh during this time, after that we refresh it in background
+        self._max_staleness_seconds = max_staleness_seconds #After this time without successful refresh, data are no more valid
+        self._last_info_time_s = 0 #Last successful refresh
+        self._last_refresh_time_s = 0 #Last refresh attempt
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        self._last_activity_time_s = 0 #Last command or state change
+        self._state = MelCloudDeviceState()
+        self._room_temperature = MelCloudTemperatureStats(temperature_window_seconds)
+        self._telemetry = MelCloudTelemetry(telemetry_size) if telemetry_size > 0 else None
+        self._dirty = {} #Changed values not yet sent to melcloud
+        self._sending = {} #Changed values being sent to melcloud
+        self._apply_lock = threading.Lock() #One SetAta/SetErv in flight per device (Changes made meanwhile go with the next one)
+        self._pending = {} #Values sent to melcloud, not yet confirmed by a refresh: key => (value, sent time)
+    
+        self._load_device_info(json)
+            
+    def __str__(self):
+        return str(self._state)
+        #return "Name: " + self._friendlyname + " ID: " + str(self._deviceid) + " BuildingID: " + str(self._buildingid)
+        #return "Temp: " + str(self.getTemperature()) + ", RoomTemp: " + str(self.getRoomTemperature()) + ", FanSpeed: " + str(self.getFanSpeed()) + ", Mode: " + str(self.getMode()) + ", PowerOn: " + str(self.isPowerOn()) + ", Online: " + str(self.isOnline())
+
+    def _load_device_info(self, json):
+        #Lightweight handle: if no info are provided, they will be fetched on first access (See MelCloud.getDevicesList)
+        if json != None:
+            self._set_device_info(json)
+
+    def _set_device_info(self, json):
+        previous = self._state.fingerprint() if self._state.valid else None
+
+        self._state.update(json)
+        self._last_info_time_s = time.time()
+        if self._telemetry != None:
+            self._telemetry.add(self._last_info_time_s, json) #As reported by melcloud
+        self._reconcile_pending(json.get("HasPendingCommand", False))
+
+        #Keep local changes until melcloud got them
+        for key, value in self._sending.items():
+            self._state.set(key, value)
+        for key, value in self._dirty.items():
+            self._state.set(key, value)
+
+        if self._state.roomTemperature != None:
+            self._room_temperature.add(self._state.roomTemperature, self._last_info_time_s)
+
+        changed = previous != self._state.fingerprint()
+        if changed and previous != None:
+            self._last_activity_time_s = self._last_info_time_s
+
+        return changed
+
+    def _reconcile_pending(self, has_pending_command):
+        #Commanded values are shown until melcloud report them (Instead of snapping back to the old value)
+        for key, (value, sent_time_s) in list(self._pending.items()):
+            age = self._last_info_time_s - sent_time_s
+
+            if self._state.get(key) == value:
+                del self._pending[key] #Confirmed
+            elif age < DEFAULT_COMMAND_TIMEOUT and (has_pending_command or age < DEFAULT_COMMAND_CONFIRM_GRACE):
+                self._state.set(key, value) #Still pending
+            else:
+                _LOGGER.warning("Device " + str(self._deviceid) + ": " + key + "=" + str(value) + " not applied by melcloud, rollback to " + str(self._state.get(key)))
+                del self._pending[key]
+
+    def hasPendingCommand(self):
+        return len(self._pending) > 0
+
+    def _refresh_device_info(self):
+        if self._cloud != None:
+            #One ListDevices request refresh all devices of the account
+            return self._cloud.refreshDevices()
+
+        return self._fetch_device_info()
+
+    def _get_device_info_data(self):
+        return {'id': self._deviceid, 'buildingID': self._buildingid}
+
+    def _fetch_device_info(self):
+        #On failure we keep serving the last known good state
+        start_s = time.perf_counter()
+        success, json = self._authentication.sendReq("GET", self._authentication.getUrl("/Device/Get"), data = self._get_device_info_data())
+        self._authentication.getMetrics().recordDevice(self._deviceid, "refresh", success, time.perf_counter() - start_s)
+        
+        if success:
+            self._set_device_info(json)
+            return True
+
+        return False
+    
+    def _background_refresh(self):
+        try:
+            self._refresh_device_info()
+        finally:
+            self._refreshing = False
+
+    def _is_info_valid(self):
+        #Stale-while-revalidate: never block on I/O, serve the last known state and refresh it in background
+        if self.getInfoAge() >= self._info_lease_seconds and (time.time() - self._last_refresh_time_s) >= self._info_lease_seconds:
+            with self._refresh_lock:
+                if not self._refreshing:
+                    _LOGGER.info("Device info lease timeout, refreshing...")
+                    self._refreshing = True
+                    self._last_refresh_time_s = time.time()
+                    threading.Thread(target = self._background_refresh, daemon = True).start()
+
+        return self.isAvailable()
+
+    def getInfoAge(self):
+        #Seconds since last successful refresh
+        if not self._state.valid:
+            return float("inf")
+
+        return time.time() - self._last_info_time_s
+
+    def isStale(self):
+        return self.getInfoAge() >= self._info_lease_seconds
+
+    def isAvailable(self):
+        return self.getInfoAge() < self._max_staleness_seconds
+
+    def isActive(self, window_seconds):
+        #A command is waiting for confirmation or the state changed recently
+        return self.hasPendingCommand() or (time.time() - self._last_activity_time_s) < window_seconds
+
+    def isIdle(self):
+        return self._state.valid and (self._state.offline or not self._state.power)
+        
+    def _set_info(self, key, value):
+        self._state.set(key, value)
+        self._dirty[key] = value
+
+    def _get_effective_flags(self):
+        #Keys that can be sent to this device
+        return EffectiveFlags.Vent if self._state.deviceType == DeviceType.Vent else EffectiveFlags.Conditioner
+
+    def _prepare_apply(self):
+        if not self._state.valid:
+            _LOGGER.error("Unable to apply device configuration !")
+            return None, None
+
+        set_api = "SetErv" if self._state.deviceType == DeviceType.Vent else "SetAta"
+        flags = self._get_effective_flags()
+
+        #Send only what changed, EffectiveFlags signal melcloud which values have to be applied
+        data = {"DeviceID": self._deviceid, "EffectiveFlags": 0, "HasPendingCommand": True}
+        for key, value in self._dirty.items():
+            if key in flags:
+                data["EffectiveFlags"] |= flags[key]
+                data[key] = value
+                self._sending[key] = value
+            else:
+                #Never sent: not held as pending, the next refresh show the reported value
+                _LOGGER.warning("Device " + str(self._deviceid) + ": " + key + " not supported by this device, ignored")
+
+        self._dirty = {}
+
+        return self._authentication.getUrl("/Device/" + set_api), data
+
+    def _complete_apply(self, success):
+        if success and len(self._sending) > 0:
+            sent_time_s = time.time()
+            for key, value in self._sending.items():
+                self._pending[key] = (value, sent_time_s)
+
+            if self._cloud != None:
+                self._cloud.notifyCommand()
+
+        if not success and len(self._sending) > 0:
+            #Not kept for a later apply: the next refresh show what melcloud report (A change from the remote must not be hidden)
+            _LOGGER.warning("Device " + str(self._deviceid) + ": unable to apply " + str(self._sending) + ", discarded")
+
+        self._sending = {}
+        return success
+
+    def apply(self):
+        with self._apply_lock:
+            url, data = self._prepare_apply()
+            if url == None:
+                return False
+
+            if data["EffectiveFlags"] == 0:
+                return self._complete_apply(True) #Nothing changed
+
+            start_s = time.perf_counter()
+            success, json = self._authentication.sendReq("POST", url, data = data)
+            self._authentication.getMetrics().recordDevice(self._deviceid, "apply", success, time.perf_counter() - start_s)
+            return self._complete_apply(success)
+
+    def getID(self):
+        return self._deviceid
+        
+    def getFriendlyName(self):
+        return self._friendlyname
+
+    def getBuildingID(self):
+        return self._buildingid
+
+    def getState(self):
+        #Device state is refreshed in place, the returned object can be kept
+        self._is_info_valid()
+        return self._state
+
+    def getDeviceType(self):
+        return self.getState().deviceType
+
+    def getTemperature(self):
+        return self.getState().temperature
+
+    def getRoomTemperature(self):
+        if not self._is_info_valid():
+            return 0
+
+        mean = self._room_temperature.getMean()
+        if mean == None:
+            return 0 #No sample in the window
+
+        return mean
+
+    def getRoomTemperatureStats(self):
+        return self._room_temperature.getStats()
+
+    def getTelemetry(self):
+        #None when disabled
+        return self._telemetry
+    
+    def getFanSpeedMax(self):
+        return self.getState().fanSpeedMax
+    
+    def getFanSpeed(self): #0 Auto, 1 to NumberOfFanSpeeds
+        return self.getState().fanSpeed
+    
+    def getVerticalSwingMode(self): #0 Auto, 1 to NumberOfVane, +1 Swing
+        return self.getState().verticalSwingMode
+
+    def getHorizontalSwingMode(self): #0 Auto, 1 to NumberOfVane, +1 Swing
+        return self.getState().horizontalSwingMode
+        
+    def getMode(self):
+        return self.getState().mode
+
+    def getVentMode(self):
+        return self.getState().ventMode
+
+    def isPowerOn(self): #boolean
+        return self.getState().power
+
+    def isOnline(self): #boolean
+        return self.getState().offline
+
+    def setVerticalSwingMode(self, swingMode):
+        if not self._is_info_valid():
+            _LOGGER.error("Unable to set swing mode: " + str(swingMode))
+            return False
+            
+        self._set_info("VaneVertical", swingMode)
+        return True
+
+    def setHorizontalSwingMode(self, swingMode):
+        if not self._is_info_valid():
+            _LOGGER.error("Unable to set swing mode: " + str(swingMode))
+            return False
+            
+        self._set_info("VaneHorizontal", swingMode)
+        return True
+
+        
+    def setTemperature(self, temperature):
+        if not self._is_info_valid():
+            _LOGGER.error("Unable to set temperature: " + str(temperature))
+            return False
+            
+        self._set_info("SetTemperature", temperature)
+        return True
+
+    def setFanSpeed(self, speed): #0 Auto, 1 to NumberOfFanSpeeds
+        if not self._is_info_valid():
+            _LOGGER.error("Unable to set fan speed: " + str(speed))
+            return False
+            
+        self._set_info("SetFanSpeed", speed)
+        return True
+        
+    def setMode(self, mode):
+        if not self._is_info_valid():
+            _LOGGER.error("Unable to set mode: " + str(mode))
+            return
+            
+        self._set_info("OperationMode", mode)
+
+    def setVentMode(self, mode):
+        if not self._is_info_valid():
+            _LOGGER.error("Unable to set mode: " + str(mode))
+            return
+
+        self._set_info("VentilationMode", mode)
+
+    def powerOn(self):
+        if not self._is_info_valid():
+            _LOGGER.error("Unable to powerOn")
+            return False
+            
+        self._set_info("Power", True)
+        return True
+        
+    def powerOff(self):
+        if not self._is_info_valid():
+            _LOGGER.error("Unable to powerOff")
+            return False
+            
+        self._set_info("Power", False)
+        return True
+
+    def setValues(self, values): #Device/Get key => value
+        if not self._is_info_valid():
+            _LOGGER.error("Unable to set values: " + str(values))
+            return False
+
+        unsupported = [key for key in values if key not in self._get_effective_flags()]
+        if len(unsupported) > 0:
+            _LOGGER.error("Device " + str(self._deviceid) + ": unable to set " + ", ".join(unsupported) + " (Not supported by this device)")
+            return False
+
+        for key, value in values.items():
+            self._set_info(key, value)
+        return True
+
+# ---------------------------------------------------------------
+
+class MelCloudDeviceAsync(MelCloudDevice):
+
+    def __init__(self, deviceid, buildingid, friendlyname, authentication, cloud = None, json = None, info_ttl_seconds = DEFAULT_INFO_TTL, max_staleness_seconds = DEFAULT_MAX_STALENESS, command_debounce_seconds = 0, temperature_window_seconds = DEFAULT_TEMPERATURE_WINDOW, telemetry_size = 0):
+        self._command_debounce_seconds = command_debounce_seconds #Changes requested during this window are merged in a single SetAta/SetErv
+        self._pending_apply = None
+        self._pending_apply_handle = None
+        self._async_apply_lock = None #Created on the event loop
+        self._listeners = []
+        self._notified_fingerprint = None
+        super().__init__(deviceid, buildingid, friendlyname, authentication, cloud, json, info_ttl_seconds, max_staleness_seconds, temperature_window_seconds, telemetry_size)
+
+    def _is_info_valid(self):
+        #Never block the event loop, info are refreshed by the poll loop (See MelCloudAsync.getPollInterval), info_ttl only flag them stale
+        return self.isAvailable()
+
+    def addUpdateListener(self, listener):
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
+
+    def getFingerprint(self):
+        #Everything an entity shows: state, availability, pending command and room temperature statistics
+        return (self._state.fingerprint(), self.isAvailable(), self.isStale(), self.hasPendingCommand(), tuple(self.getRoomTemperatureStats().values()))
+
+    def _notify_update(self):
+        #Push to listeners only what changed since the last notification (Most polls return the same state)
+        fingerprint = self.getFingerprint()
+        if fingerprint == self._notified_fingerprint:
+            return False
+
+        self._notified_fingerprint = fingerprint
+        for listener in list(self._listeners):
+            listener()
+        return True
+
+    async def async_refresh_device_info(self):
+        if self._cloud != None:
+            return await self._cloud.async_refreshDevices()
+
+        return await self.async_fetch_device_info()
+
+    async def async_fetch_device_info(self):
+        start_s = time.perf_counter()
+        success, json = await self._authentication.async_sendReq("GET", self._authentication.getUrl("/Device/Get"), data = self._get_device_info_data())
+        self._authentication.getMetrics().recordDevice(self._deviceid, "refresh", success, time.perf_counter() - start_s)
+        if success:
+            self._set_device_info(json)
+            return True
+
+        return False
+
+    def _get_async_apply_lock(self):
+        if self._async_apply_lock == None:
+            self._async_apply_lock = asyncio.Lock()
+
+        return self._async_apply_lock
+
+    async def _async_send_apply(self):
+        #Serialized like apply(): a flush started while a POST is in flight waits for its result before preparing the next batch
+        async with self._get_async_apply_lock():
+            url, data = self._prepare_apply()
+            if url == None:
+                return False
+
+            if data["EffectiveFlags"] == 0:
+                return self._complete_apply(True) #Nothing changed
+
+            start_s = time.perf_counter()
+            success, json = await self._authentication.async_sendReq("POST", url, data = data)
+            self._authentication.getMetrics().recordDevice(self._deviceid, "apply", success, time.perf_counter() - start_s)
+            return self._complete_apply(success)
+
+    async def _async_flush_apply(self):
+        pending = self._pending_apply
+        self._pending_apply = None
+        self._pending_apply_handle = None
+
+        try:
+            pending.set_result(await self._async_send_apply())
+        except Exception as e:
+            pending.set_exception(e)
+
+    async def async_apply(self):
+        if self._command_debounce_seconds <= 0:
+            return await self._async_send_apply()
+
+        loop = asyncio.get_event_loop()
+
+        if self._pending_apply == None:
+            self._pending_apply = loop.create_future()
+
+        #Superseded by this new change: restart the debounce window
+        if self._pending_apply_handle != None:
+            self._pending_apply_handle.cancel()
+
+        self._pending_apply_handle = loop.call_later(self._command_debounce_seconds, lambda: loop.create_task(self._async_flush_apply()))
+
+        return await asyncio.shield(self._pending_apply)
+
+# ---------------------------------------------------------------
+
+class MelCloud:
+
+    #ListDevices "Device" block use different key names than Device/Get for few fields
+    LIST_DEVICES_KEYS = {"FanSpeed": "SetFanSpeed", "VaneHorizontalDirection": "VaneHorizontal", "VaneVerticalDirection": "VaneVertical"}
+
+    def __init__(self, authentication, max_parallel_requests = DEFAULT_MAX_PARALLEL_REQUESTS, info_ttl_seconds = DEFAULT_INFO_TTL, max_staleness_seconds = DEFAULT_MAX_STALENESS):
+        self._authentication = authentication
+        self._max_parallel_requests = max_parallel_requests
+        self._info_ttl_seconds = info_ttl_seconds
+        self._max_staleness_seconds = max_staleness_seconds
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._refresh_lease_seconds = 10 #All devices updated during the same poll cycle share the same snapshot
+        self._last_refresh_time_s = 0
+        self._last_refresh_success = False
+        self._last_sync_time_s = 0
+        self._topology_sync_interval_s = DEFAULT_TOPOLOGY_SYNC_INTERVAL
+        self._temperature_window_s = DEFAULT_TEMPERATURE_WINDOW
+        self._max_parallel_commands = DEFAULT_MAX_PARALLEL_COMMANDS
+        self._telemetry_size = 0
+        self.setPollIntervals(DEFAULT_FAST_POLL_INTERVAL, DEFAULT_POLL_INTERVAL, DEFAULT_IDLE_POLL_INTERVAL)
+    
+    def _iter_buildings(self, content):
+        #Decode the ListDevices array one building at a time: the whole reply is never materialized,
+        #each building is dropped once its devices are walked (See _iter_devices)
+        text = content.decode("utf-8") if isinstance(content, bytes) else content
+        decoder = json.JSONDecoder()
+        skip = json.decoder.WHITESPACE
+
+        index = skip.match(text, 0).end()
+        if text[index:index + 1] != "[":
+            raise ValueError("ListDevices reply is not an array")
+
+        index = skip.match(text, index + 1).end()
+        if text[index:index + 1] == "]":
+            return
+
+        while True:
+            building, index = decoder.raw_decode(text, index)
+            yield building
+
+            index = skip.match(text, index).end()
+            if text[index:index + 1] == ",":
+                index = skip.match(text, index + 1).end()
+            elif text[index:index + 1] == "]":
+                return
+            else:
+                raise ValueError("ListDevices reply is truncated or invalid at " + str(index))
+
+    def _walk_devices(self, walker, json):
+        #ListDevices is parsed lazily: a malformed reply is only detected while walking it
+        try:
+            return True, walker(json)
+        except (ValueError, KeyError, TypeError) as e:
+            _LOGGER.error("Invalid ListDevices reply (" + str(e) + ")")
+            return False, None
+
+    def _iter_devices(self, json):
+        for entry in json:
+        
+            #Flat devices
+            for device in entry["Structure"]["Devices"]:
+                yield device
+            
+            #Areas devices
+            for areas in entry["Structure"]["Areas"]:
+                for device in areas["Devices"]:
+                    yield device
+            
+            #Floor devices
+            for floor in entry["Structure"]["Floors"]:
+                for device in floor["Devices"]:
+                    yield device
+                
+                for areas in floor["Areas"]:
+                    for device in areas["Devices"]:
+                        yield device
+
+    def _get_device_info(self, device):
+        if "Device" not in device or device["Device"] == None:
+            return None
+
+        info = dict(device["Device"])
+        for list_key, get_key in self.LIST_DEVICES_KEYS.items():
+            if list_key in info and get_key not in info:
+                info[get_key] = info[list_key]
+
+        info["DeviceID"] = device["DeviceID"]
+        if "Offline" not in info and "Offline" in device:
+            info["Offline"] = device["Offline"]
+
+        return info
+
+    def setPollIntervals(self, fast_seconds, normal_seconds, idle_seconds, activity_window_seconds = DEFAULT_ACTIVITY_WINDOW):
+        self._fast_poll_interval_s = fast_seconds
+        self._poll_interval_s = normal_seconds
+        self._idle_poll_interval_s = idle_seconds
+        self._activity_window_s = activity_window_seconds
+
+    def setTopologySyncInterval(self, seconds):
+        #0 to disable
+        self._topology_sync_interval_s = seconds
+
+    def setTemperatureWindow(self, seconds):
+        #Room temperature averaging window of the devices created from now on
+        self._temperature_window_s = seconds
+
+    def setTelemetrySize(self, size):
+        #Samples kept per device created from now on (0 to disable)
+        self._telemetry_size = size
+
+    def getTelemetryData(self):
+        return {str(deviceid): device._telemetry.toDict() for deviceid, device in self._devices.items() if device._telemetry != None}
+
+    def loadTelemetry(self, data):
+        #From a previous getTelemetryData(), for the devices already known
+        for deviceid, device in self._devices.items():
+            if device._telemetry != None and str(deviceid) in data:
+                device._telemetry.loadDict(data[str(deviceid)])
+
+    def setMaxParallelCommands(self, count):
+        self._max_parallel_commands = count
+
+    def _prepare_group(self, commands):
+        #commands: deviceid => values (See MelCloudDevice.setValues), return devices to apply and results of the others
+        devices = []
+        results = {}
+
+        for deviceid, values in commands.items():
+            device = self._devices.get(deviceid)
+            if device == None:
+                _LOGGER.error("Group command: unknown device " + str(deviceid))
+                results[deviceid] = False
+            elif not device.setValues(values):
+                results[deviceid] = False
+            else:
+                devices.append(device)
+
+        return devices, results
+
+    def applyGroup(self, commands):
+        #Send all commands concurrently, return deviceid => success
+        devices, results = self._prepare_group(commands)
+
+        if len(devices) > 0:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers = self._max_parallel_commands) as executor:
+                results.update(zip([device.getID() for device in devices], executor.map(lambda device: device.apply(), devices)))
+
+        return results
+
+    def _is_sync_needed(self):
+        return self._topology_sync_interval_s > 0 and (time.time() - self._last_sync_time_s) >= self._topology_sync_interval_s
+
+    def getPollInterval(self):
+        #Poll faster when a device is changing, slower when all devices are off or offline
+        interval = self._idle_poll_interval_s
+
+        for device in self._devices.values():
+            if device.isActive(self._activity_window_s):
+                return self._fast_poll_interval_s
+
+            if not device.isIdle():
+                interval = self._poll_interval_s
+
+        return interval
+
+    def getNextPollDelay(self):
+        delay = self.getPollInterval() - (time.time() - self._last_refresh_time_s)
+        return max(0, delay, self._authentication.getRetryAfter())
+
+    def notifyCommand(self):
+        pass
+
+    def getMetrics(self):
+        return self._authentication.getMetrics()
+
+    def _create_device(self, device):
+        return MelCloudDevice(device["DeviceID"], device["BuildingID"], device["DeviceName"], self._authentication, self, self._get_device_info(device), self._info_ttl_seconds, self._max_staleness_seconds, temperature_window_seconds = self._temperature_window_s, telemetry_size = self._telemetry_size)
+
+    def _create_devices(self, json):
+        devices = []
+
+        for device in self._iter_devices(json):
+            mcdevice = self._create_device(device)
+            self._devices[mcdevice.getID()] = mcdevice
+            devices.append(mcdevice)
+
+        self._last_refresh_time_s = time.time()
+        self._last_refresh_success = True
+        self._last_sync_time_s = self._last_refresh_time_s
+        return devices
+
+    def _sync_devices(self, json):
+        #Update known devices, create new ones and forget the ones not listed anymore
+        added = []
+        listed = set()
+
+        for device in self._iter_devices(json):
+            listed.add(device["DeviceID"])
+
+            if device["DeviceID"] in self._devices:
+                info = self._get_device_info(device)
+                if info != None:
+                    self._devices[device["DeviceID"]]._set_device_info(info)
+            else:
+                mcdevice = self._create_device(device)
+                self._devices[mcdevice.getID()] = mcdevice
+                added.append(mcdevice)
+
+        removed = [self._devices.pop(deviceid) for deviceid in list(self._devices) if deviceid not in listed]
+
+        self._last_refresh_time_s = time.time()
+        self._last_refresh_success = True
+        self._last_sync_time_s = self._last_refresh_time_s
+        return added, removed
+
+    def getCacheData(self):
+        devices = []
+        for device in self._devices.values():
+            if device._state.valid:
+                devices.append({"DeviceID": device.getID(), "BuildingID": device._buildingid, "DeviceName": device.getFriendlyName(), "Device": device._state.toDict(), "Time": device._last_info_time_s})
+
+        return {"contextkey": self._authentication.getContextKey(), "contextkey_expiry": self._authentication.getContextKeyExpiry(), "devices": devices}
+
+    def loadCache(self, data):
+        #Create devices from a previous getCacheData(), they have to be revalidated (See syncDevices)
+        if data.get("contextkey") != None:
+            self._authentication.setContextKey(data["contextkey"], data.get("contextkey_expiry"))
+
+        devices = self._create_devices([{"Structure": {"Devices": data.get("devices", []), "Areas": [], "Floors": []}}])
+        for device, cached in zip(devices, data.get("devices", [])):
+            device._last_info_time_s = cached.get("Time", 0)
+            if device._telemetry != None:
+                device._telemetry.clear() #Not a new sample
+
+        self._last_refresh_time_s = 0
+        self._last_sync_time_s = 0
+        return devices
+
+    def syncDevices(self):
+        with self._lock:
+            success, json = self._authentication.sendReq("GET", self._authentication.getUrl("/User/ListDevices"), decode = self._iter_buildings)
+            if success:
+                success, result = self._walk_devices(self._sync_devices, json)
+
+            if not success:
+                return None, None
+
+            return result
+
+    def _update_devices(self, json):
+        for device in self._iter_devices(json):
+            if device["DeviceID"] in self._devices:
+                info = self._get_device_info(device)
+                if info != None:
+                    self._devices[device["DeviceID"]]._set_device_info(info)
+
+    def _is_refresh_needed(self, force):
+        return force or (time.time() - self._last_refresh_time_s) >= self._refresh_lease_seconds
+
+    def refreshDevices(self, force = False):
+        with self._lock:
+            if not self._is_refresh_needed(force):
+                return self._last_refresh_success
+
+            _LOGGER.debug("Refreshing all devices ...")
+
+            self._last_refresh_time_s = time.time()
+            self._last_refresh_success, json = self._authentication.sendReq("GET", self._authentication.getUrl("/User/ListDevices"), decode = self._iter_buildings)
+            if self._last_refresh_success:
+                self._last_refresh_success, result = self._walk_devices(self._update_devices, json)
+
+            return self._last_refresh_success
+
+    def getDevicesList(self):
+        with self._lock:
+            success, json = self._authentication.sendReq("GET", self._authentication.getUrl("/User/ListDevices"), decode = self._iter_buildings)
+            if success:
+                success, devices = self._walk_devices(self._create_devices, json)
+
+            if not success:
+                return []
+
+        #Devices without state in the ListDevices payload are fetched in parallel
+        missing = [device for device in devices if not device._state.valid]
+        if len(missing) > 0:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers = self._max_parallel_requests) as executor:
+                list(executor.map(lambda device: device._fetch_device_info(), missing))
+
+        return devices
+
+# ---------------------------------------------------------------
+
+class MelCloudAsync(MelCloud):
+
+    def __init__(self, authentication, max_parallel_requests = DEFAULT_MAX_PARALLEL_REQUESTS, info_ttl_seconds = DEFAULT_INFO_TTL, max_staleness_seconds = DEFAULT_MAX_STALENESS, command_debounce_seconds = DEFAULT_COMMAND_DEBOUNCE):
+        super().__init__(authentication, max_parallel_requests, info_ttl_seconds, max_staleness_seconds)
+        self._command_debounce_seconds = command_debounce_seconds
+        self._async_lock = None
+        self._poll_wakeup = None
+        self._poll_task = None
+        self._refresh_listeners = []
+        self._topology_listeners = []
+
+    def _get_async_lock(self):
+        if self._async_lock == None:
+            self._async_lock = asyncio.Lock()
+
+        return self._async_lock
+
+    def addRefreshListener(self, listener):
+        self._refresh_listeners.append(listener)
+        return lambda: self._refresh_listeners.remove(listener)
+
+    def addTopologyListener(self, listener):
+        #Coroutine listener(added, removed), called when the poll picks up new or removed devices
+        self._topology_listeners.append(listener)
+        return lambda: self._topology_listeners.remove(listener)
+
+    def notifyCommand(self):
+        #Re-schedule the next poll with the fast interval
+        if self._poll_wakeup != None:
+            self._poll_wakeup.set()
+
+    async def _async_poll_loop(self):
+        #Spread accounts polls over the interval instead of bursting
+        await asyncio.sleep(random.uniform(0, self._fast_poll_interval_s))
+
+        #Also checked as wait_for can swallow the cancellation when the wakeup event is set at the same time
+        while self._poll_task != None:
+            delay = self.getNextPollDelay()
+            if delay > 0:
+                self._poll_wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._poll_wakeup.wait(), delay)
+                    continue #Woken up by a command, compute delay again
+                except asyncio.TimeoutError:
+                    pass
+
+            try:
+                await self._async_poll()
+            except Exception:
+                #Polling must survive anything: devices would never come back from unavailable
+                _LOGGER.exception("Polling devices failed")
+                self._last_refresh_time_s = time.time() #Wait a poll interval before the next attempt
+
+    async def _async_poll(self):
+        _LOGGER.debug("Polling devices (Next poll in " + str(self.getPollInterval()) + "s) ...")
+        if self._is_sync_needed():
+            #Same ListDevices request, devices are also diffed against the known ones
+            added, removed = await self.async_syncDevices()
+            if added != None and (len(added) > 0 or len(removed) > 0):
+                _LOGGER.info("Devices changed: " + str(len(added)) + " added, " + str(len(removed)) + " removed")
+                for listener in list(self._topology_listeners):
+                    await listener(added, removed)
+        else:
+            await self.async_refreshDevices(force = True)
+
+        #Only devices whose state changed are written to HomeAssistant
+        for device in list(self._devices.values()):
+            device._notify_update()
+
+        for listener in list(self._refresh_listeners):
+            listener()
+
+    def startPolling(self):
+        if self._poll_task == None:
+            self._poll_wakeup = asyncio.Event()
+            self._poll_task = asyncio.ensure_future(self._async_poll_loop())
+
+    async def async_stopPolling(self):
+        if self._poll_task != None:
+            poll_task = self._poll_task
+            self._poll_task = None
+            poll_task.cancel()
+            try:
+                await poll_task
+            except asyncio.CancelledError:
+                pass
+
+            self._poll_wakeup = None
+
+    def _create_device(self, device):
+        return MelCloudDeviceAsync(device["DeviceID"], device["BuildingID"], device["DeviceName"], self._authentication, self, self._get_device_info(device), self._info_ttl_seconds, self._max_staleness_seconds, self._command_debounce_seconds, self._temperature_window_s, self._telemetry_size)
+
+    async def async_refreshDevices(self, force = False):
+        async with self._get_async_lock():
+            if not self._is_refresh_needed(force):
+                return self._last_refresh_success
+
+            _LOGGER.debug("Refreshing all devices ...")
+
+            self._last_refresh_time_s = time.time()
+            self._last_refresh_success, json = await self._authentication.async_sendReq("GET", self._authentication.getUrl("/User/ListDevices"), decode = self._iter_buildings)
+            if self._last_refresh_success:
+                self._last_refresh_success, result = self._walk_devices(self._update_devices, json)
+
+            return self._last_refresh_success
+
+    async def async_syncDevices(self):
+        async with self._get_async_lock():
+            success, json = await self._authentication.async_sendReq("GET", self._authentication.getUrl("/User/ListDevices"), decode = self._iter_buildings)
+            if success:
+                success, result = self._walk_devices(self._sync_devices, json)
+
+            if not success:
+                return None, None
+
+            added, removed = result
+
+        #Also retry devices whose Device/Get failed on a previous sync
+        await self._async_fetch_missing_devices(list(self._devices.values()))
+        return added, removed
+
+    async def _async_fetch_missing_devices(self, devices):
+        #Devices without state in the ListDevices payload are fetched concurrently
+        semaphore = asyncio.Semaphore(self._max_parallel_requests)
+
+        async def async_fetch(device):
+            async with semaphore:
+                await device.async_fetch_device_info()
+
+        await asyncio.gather(*[async_fetch(device) for device in devices if not device._state.valid])
+
+    async def async_applyGroup(self, commands):
+        #Commands are sent right away (No debounce), at most max_parallel_commands at a time
+        devices, results = self._prepare_group(commands)
+        semaphore = asyncio.Semaphore(self._max_parallel_commands)
+
+        async def async_apply(device):
+            async with semaphore:
+                return await device._async_send_apply()
+
+        results.update(zip([device.getID() for device in devices], await asyncio.gather(*[async_apply(device) for device in devices])))
+        return results
+
+    async def async_getDevicesList(self):
+        async with self._get_async_lock():
+            success, json = await self._authentication.async_sendReq("GET", self._authentication.getUrl("/User/ListDevices"), decode = self._iter_buildings)
+            if success:
+                success, devices = self._walk_devices(self._create_devices, json)
+
+            if not success:
+                return []
+
+        await self._async_fetch_missing_devices(devices)
+        return devices
+
+# ---------------------------------------------------------------
+# Command line: fleet snapshot/export and batch commands over one or more accounts
+
+SNAPSHOT_FIELDS = ["Account", "DeviceID", "BuildingID", "DeviceName"] + list(MelCloudDeviceState.KEYS)
+
+class MelCloudCliTiming:
+    #Wall time of each phase, accounts run concurrently so a phase spans from its first start to its last end
+    def __init__(self):
+        self._phases = {} #name => [first start, last end, count]
+
+    def record(self, name, start_s):
+        end_s = time.perf_counter()
+        phase = self._phases.setdefault(name, [start_s, end_s, 0])
+        phase[0] = min(phase[0], start_s)
+        phase[1] = max(phase[1], end_s)
+        phase[2] += 1
+
+    def report(self, stream):
+        for name, (start_s, end_s, count) in self._phases.items():
+            stream.write("%-10s %8.3fs %6d\n" % (name, end_s - start_s, count))
+
+class MelCloudCli:
+    def __init__(self, args):
+        self._args = args
+        self._timing = MelCloudCliTiming()
+        self._clouds = {} #email => MelCloudAsync, logged in accounts
+        self._errors = 0
+
+    def _get_accounts(self):
+        accounts = [{"email": email, "password": password} for email, password in self._args.account or []]
+        if self._args.accounts != None:
+            with open(self._args.accounts) as f:
+                accounts += json.load(f)
+
+        #Same account listed twice would be polled twice
+        return list({account["email"]: account for account in accounts}.values())
+
+    async def _async_load_account(self, account):
+        mcauth = MelCloudAuthenticationAsync(account["email"], account["password"], pool_size = self._args.parallel, base_url = self._args.url)
+        mc = MelCloudAsync(mcauth, self._args.parallel, command_debounce_seconds = 0)
+        mc.setMaxParallelCommands(self._args.parallel)
+
+        start_s = time.perf_counter()
+        success = await mcauth.async_login()
+        self._timing.record("login", start_s)
+        if not success:
+            return await self._async_fail_account(account, mcauth, "login failed")
+
+        #Not async_getDevicesList: a failed ListDevices must not look like an account without devices
+        start_s = time.perf_counter()
+        devices, removed = await mc.async_syncDevices()
+        self._timing.record("list", start_s)
+        if devices == None:
+            return await self._async_fail_account(account, mcauth, "unable to list devices")
+
+        self._clouds[account["email"]] = mc
+        return account["email"], mc, devices
+
+    async def _async_fail_account(self, account, mcauth, error):
+        _LOGGER.error("Account " + account["email"] + ": " + error)
+        self._errors += 1
+        await mcauth.async_close()
+        return account["email"], None, []
+
+    def _iter_accounts(self):
+        #Accounts are loaded concurrently, yielded as soon as each one is ready
+        return asyncio.as_completed([self._async_load_account(account) for account in self._get_accounts()])
+
+    async def async_close(self):
+        await asyncio.gather(*[mc._authentication.async_close() for mc in self._clouds.values()])
+
+    # -----------------------------------------------------------
+
+    async def async_snapshot(self, output):
+        writer = None
+        if self._args.format == "csv":
+            import csv
+            writer = csv.DictWriter(output, SNAPSHOT_FIELDS)
+            writer.writeheader()
+
+        count = 0
+        for account in self._iter_accounts():
+            email, mc, devices = await account
+
+            start_s = time.perf_counter()
+            for device in devices:
+                row = {"Account": email, "DeviceID": device.getID(), "BuildingID": device.getBuildingID(), "DeviceName": device.getFriendlyName()}
+                row.update(device.getState().toDict())
+
+                if writer != None:
+                    writer.writerow(row)
+                else:
+                    output.write(json.dumps(row) + "\n")
+            output.flush()
+            self._timing.record("write", start_s)
+            count += len(devices)
+
+        _LOGGER.info(str(count) + " device(s) exported")
+
+    # -----------------------------------------------------------
+
+    def _read_commands(self):
+        #JSON Lines: {"DeviceID": 1000, "Power": true, "SetTemperature": 22} ("Account": email when a DeviceID is in several accounts)
+        commands = []
+        with (sys.stdin if self._args.commands == "-" else open(self._args.commands)) as f:
+            for line in f:
+                line = line.strip()
+                if len(line) > 0 and not line.startswith("#"):
+                    commands.append(json.loads(line))
+
+        return commands
+
+    def _find_device(self, command):
+        clouds = self._clouds.items()
+        if "Account" in command:
+            clouds = [(email, mc) for email, mc in clouds if email == command["Account"]]
+
+        found = [(email, mc._devices[command["DeviceID"]]) for email, mc in clouds if command["DeviceID"] in mc._devices]
+        if len(found) != 1:
+            return None, None, "unknown device" if len(found) == 0 else "device in several accounts, set Account"
+
+        return found[0][0], found[0][1], None
+
+    def _prepare_command(self, command):
+        #Return account, device, changed values (Only what differs from the current state is sent) or an error
+        if "DeviceID" not in command:
+            return None, None, None, "no DeviceID"
+
+        email, device, error = self._find_device(command)
+        if error != None:
+            return email, None, None, error
+
+        state = device.getState()
+        flags = device._get_effective_flags()
+        values = {key: value for key, value in command.items() if key not in ("DeviceID", "Account")}
+
+        for key in values:
+            if key not in flags:
+                return email, device, None, "unsupported key " + key
+
+        return email, device, {key: value for key, value in values.items() if state.get(key) != value}, None
+
+    async def async_apply(self, output):
+        commands = self._read_commands()
+
+        for account in self._iter_accounts():
+            await account
+
+        start_s = time.perf_counter()
+        groups = {} #email => deviceid => values
+        results = []
+
+        for command in commands:
+            email, device, values, error = self._prepare_command(command)
+            result = {"Account": email, "DeviceID": command.get("DeviceID")}
+
+            if error != None:
+                result.update({"Status": "error", "Error": error})
+                self._errors += 1
+            elif len(values) == 0:
+                result["Status"] = "unchanged"
+            elif self._args.dry_run:
+                result.update({"Status": "dry-run", "Values": values})
+            else:
+                #Several lines for the same device are merged, the last value wins
+                groups.setdefault(email, {}).setdefault(device.getID(), {}).update(values)
+                result.update({"Status": None, "Values": values})
+
+            results.append(result)
+        self._timing.record("prepare", start_s)
+
+        start_s = time.perf_counter()
+        applied = await asyncio.gather(*[self._clouds[email].async_applyGroup(group) for email, group in groups.items()])
+        applied = {(email, deviceid): success for email, group_results in zip(groups, applied) for deviceid, success in group_results.items()}
+        if len(groups) > 0:
+            self._timing.record("apply", start_s)
+
+        for result in results:
+            if result["Status"] == None:
+                success = applied.get((result["Account"], result["DeviceID"]), False)
+                result["Status"] = "applied" if success else "failed"
+                if not success:
+                    self._errors += 1
+
+            output.write(json.dumps(result) + "\n")
+        output.flush()
+
+    # -----------------------------------------------------------
+
+    async def async_run(self):
+        output = sys.stdout if self._args.output == None else open(self._args.output, "w", newline = "")
+        start_s = time.perf_counter()
+
+        try:
+            if self._args.command == "snapshot":
+                await self.async_snapshot(output)
+            else:
+                await self.async_apply(output)
+        finally:
+            await self.async_close()
+            if output is not sys.stdout:
+                output.close()
+
+        self._timing.record("total", start_s)
+        if not self._args.quiet:
+            self._timing.report(sys.stderr)
+
+        return self._errors == 0
+
+# ---------------------------------------------------------------
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "MELCloud fleet snapshot and batch commands")
+    parser.add_argument("command", choices = ["snapshot", "apply"])
+    parser.add_argument("--account", nargs = 2, action = "append", metavar = ("EMAIL", "PASSWORD"))
+    parser.add_argument("--accounts", help = "JSON file: [{\"email\": ..., \"password\": ...}]")
+    parser.add_argument("--format", choices = ["jsonl", "csv"], default = "jsonl", help = "Snapshot format")
+    parser.add_argument("--output", help = "Output file (Default: stdout)")
+    parser.add_argument("--commands", default = "-", help = "Batch commands, JSON Lines (Default: stdin)")
+    parser.add_argument("--dry-run", action = "store_true", help = "Print what would be sent, send nothing")
+    parser.add_argument("--parallel", type = int, default = DEFAULT_MAX_PARALLEL_COMMANDS, help = "Max concurrent requests per account")
+    parser.add_argument("--url", default = MELCLOUD_URL)
+    parser.add_argument("--quiet", action = "store_true", help = "No timing on stderr")
+    parser.add_argument("--verbose", action = "store_true")
+    args = parser.parse_args()
+
+    if args.account == None and args.accounts == None:
+        parser.error("--account or --accounts is required")
+
+    logging.basicConfig(stream = sys.stderr, level = logging.DEBUG if args.verbose else logging.WARNING)
+
+    sys.exit(0 if asyncio.run(MelCloudCli(args).async_run()) else 1)
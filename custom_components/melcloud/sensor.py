@@ -0,0 +1,219 @@
+"""
+    MELCloud diagnostic sensors, created by the climate platform (See climate.py)
+
+    Expose the API client metrics (See MelCloudMetrics):
+        requests, errors, logins, re-logins, rate limited, retries, short-circuited, latency p50/p99, received bytes
+    Per endpoint details are available as state attributes.
+
+    And per device telemetry sensors (See MelCloudTelemetry, telemetry_size option):
+        room temperature, energy (When reported by the device)
+    Hourly min/max/mean of the last 24h are available as state attributes.
+"""
+
+import logging
+import time
+
+from homeassistant.const import CONF_EMAIL, TEMP_CELSIUS
+from homeassistant.helpers.entity import Entity
+
+from .climate import DOMAIN, CONF_ACCOUNTS
+from .melcloud import DEFAULT_TELEMETRY_BUCKET
+
+_LOGGER = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------
+
+def _sum_endpoints(key):
+    return lambda metrics, snapshot: sum(stats[key] for stats in snapshot["endpoints"].values())
+
+def _counter(name):
+    return lambda metrics, snapshot: snapshot["counters"].get(name, 0)
+
+def _latency(percent):
+    def value(metrics, snapshot):
+        latency = metrics.getLatencyPercentile(percent)
+        if latency == None or latency == float("inf"):
+            return None
+        return int(latency * 1000)
+    return value
+
+#Name, unit, icon, value(metrics, snapshot)
+SENSORS = [
+    ("Requests", "requests", "mdi:swap-vertical", _sum_endpoints("calls")),
+    ("Request errors", "requests", "mdi:alert-circle-outline", _sum_endpoints("errors")),
+    ("Logins", "logins", "mdi:login", _counter("login")),
+    ("Re-logins", "logins", "mdi:login-variant", _counter("relogin")),
+    ("Rate limited", "requests", "mdi:speedometer-slow", _counter("rate_limited")),
+    ("Retries", "requests", "mdi:refresh", _counter("retry")),
+    ("Short-circuited", "requests", "mdi:electric-switch-closed", _counter("short_circuited")),
+    ("Request latency p50", "ms", "mdi:timer-outline", _latency(50)),
+    ("Request latency p99", "ms", "mdi:timer-alert-outline", _latency(99)),
+    ("Received bytes", "B", "mdi:download-network-outline", _sum_endpoints("response_bytes"))
+]
+
+def _round(value):
+    return None if value == None else round(value, 1)
+
+def _int(value):
+    return None if value == None else int(value)
+
+#Name, telemetry field, unit, icon, value(last sample)
+TELEMETRY_SENSORS = [
+    ("Room temperature", "room_temperature", TEMP_CELSIUS, "mdi:thermometer", _round),
+    ("Setpoint", "temperature", TEMP_CELSIUS, "mdi:thermostat", _round),
+    ("Power", "power", None, "mdi:power", _int),
+    ("Mode", "mode", None, "mdi:format-list-bulleted", _int),
+    ("Energy", "energy", "Wh", "mdi:flash", _round)
+]
+
+TELEMETRY_HISTORY = 24 * 3600 #seconds, downsampled in state attributes
+
+# ---------------------------------------------------------------
+
+class MelCloudMetricSensor(Entity):
+
+    def __init__(self, email, multiple, metrics, name, unit, icon, value):
+        self._email = email
+        self._multiple = multiple #Several accounts: sensors names include the account
+        self._metrics = metrics
+        self._name = name
+        self._unit = unit
+        self._icon = icon
+        self._value = value
+        self._state = None
+        self._attributes = {}
+
+    @property
+    def should_poll(self):
+        return True
+
+    async def async_update(self):
+        snapshot = self._metrics.getSnapshot()
+        self._state = self._value(self._metrics, snapshot)
+        self._attributes = {"account": self._email, "endpoints": {endpoint: {"calls": stats["calls"], "errors": stats["errors"]} for endpoint, stats in snapshot["endpoints"].items()}}
+
+    @property
+    def name(self):
+        if self._multiple:
+            return "MELCloud " + self._email + " " + self._name
+        return "MELCloud " + self._name
+
+    @property
+    def unit_of_measurement(self):
+        return self._unit
+
+    @property
+    def icon(self):
+        return self._icon
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def device_state_attributes(self):
+        return self._attributes
+
+# ---------------------------------------------------------------
+
+class MelCloudTelemetrySensor(Entity):
+
+    def __init__(self, device, name, field, unit, icon, value):
+        self._device = device
+        self._name = name
+        self._field = field
+        self._unit = unit
+        self._icon = icon
+        self._value = value
+        self._state = None
+        self._attributes = {}
+
+    @property
+    def should_poll(self):
+        return True #Read from memory, recorded by the climate platform refreshes
+
+    async def async_update(self):
+        telemetry = self._device.getTelemetry()
+        self._state = self._value(telemetry.getLast(self._field))
+        self._attributes = {"samples": len(telemetry), "hourly": telemetry.getDownsampled(self._field, DEFAULT_TELEMETRY_BUCKET, time.time() - TELEMETRY_HISTORY)}
+
+    @property
+    def available(self):
+        return self._device.isAvailable()
+
+    @property
+    def name(self):
+        return "MELCloud " + self._device.getFriendlyName() + " (" + str(self._device.getID()) + ") " + self._name
+
+    @property
+    def unit_of_measurement(self):
+        return self._unit
+
+    @property
+    def icon(self):
+        return self._icon
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def device_state_attributes(self):
+        return self._attributes
+
+def _create_telemetry_sensors(devices, existing):
+    #existing: (deviceid, field) of the sensors already created, updated
+    sensors = []
+    for device in devices:
+        if device.getTelemetry() == None:
+            continue
+
+        for name, field, unit, icon, value in TELEMETRY_SENSORS:
+            #Energy only for units with a meter (Known once the device state is loaded)
+            if (device.getID(), field) in existing or (field == "energy" and not device.getState().energyMeter):
+                continue
+
+            existing.add((device.getID(), field))
+            sensors.append(MelCloudTelemetrySensor(device, name, field, unit, icon, value))
+
+    return sensors
+
+# ---------------------------------------------------------------
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    if discovery_info is None:
+        return
+
+    email = discovery_info[CONF_EMAIL]
+    multiple = discovery_info.get(CONF_ACCOUNTS, False)
+    mc = hass.data[DOMAIN][email]
+    metrics = mc.getMetrics()
+
+    async_add_entities([MelCloudMetricSensor(email, multiple, metrics, name, unit, icon, value) for name, unit, icon, value in SENSORS], True)
+
+    existing = set()
+    telemetry_sensors = _create_telemetry_sensors(mc._devices.values(), existing)
+    async_add_entities(telemetry_sensors, True)
+
+    def add_sensors(devices):
+        sensors = _create_telemetry_sensors(devices, existing)
+        if len(sensors) > 0:
+            telemetry_sensors.extend(sensors)
+            async_add_entities(sensors, True)
+
+    async def async_update_sensors(added, removed):
+        #Follow the climate platform topology sync
+        removed_ids = set(device.getID() for device in removed)
+        for sensor in [sensor for sensor in telemetry_sensors if sensor._device.getID() in removed_ids]:
+            telemetry_sensors.remove(sensor)
+            existing.discard((sensor._device.getID(), sensor._field))
+            await sensor.async_remove()
+
+        add_sensors(added)
+
+    def add_missing_sensors():
+        #Devices loaded from the cache or without state at setup: energy support is known after a refresh
+        add_sensors(list(mc._devices.values()))
+
+    mc.addTopologyListener(async_update_sensors)
+    mc.addRefreshListener(add_missing_sensors)